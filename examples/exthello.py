@@ -20,12 +20,27 @@ def say(pred, a, b):
 @ext.predicate('complex', 1, needs_context=True)
 def complex(pred, a, *, context=None):
     # More complex or involved predicates can request that they are given the
-    # query context. This makes it possible to set up a query-level cache in an
-    # @ext.before_ask function, use the cache in the predicates, and tear down
-    # the cache in an #ext.after_ask function.
+    # query context. This makes it possible to keep state for a query in an
+    # @ext.before_ask function, use it in the predicates, and tear it down in
+    # an @ext.after_ask function. To simply reuse answers, see the cache
+    # parameter used for 'length' below.
     yield Clause(Literal(pred, [Constant.number(1337)]))
 
 
+# Predicates backed by large tables should not produce every row for each
+# query. By declaring binding modes, the predicate is called with the python
+# values of the bound arguments, None for the free ones, and only produces the
+# matching rows as tuples. Here, the first argument must always be bound.
+# The answers for each word are cached for the whole session, so the table is
+# only consulted once per word.
+lengths = {'hello': 5, 'world': 5, 'judged': 6}
+
+@ext.predicate('length', 2, modes=['bf', 'bb'], cache='session')
+def length(word, size):
+    if word in lengths and size in (None, lengths[word]):
+        yield (word, lengths[word])
+
+
 @ext.setup
 def init(context, thing="(default)", **rest):
     """Initialise the exthello extension, which takes one parameter 'thing'.
@@ -43,7 +58,7 @@ def init(context, thing="(default)", **rest):
 
 
 # It is possible to set up one or more functions to be called before and after
-# the actual query runs. This allows the use of query-lifetime caches.
+# the actual query runs. This allows the use of query-lifetime state.
 
 @ext.before_ask
 def prepare_something(context):
@@ -2,6 +2,8 @@
 The judged module.
 """
 
+import threading
+
 from judged import interned
 from judged import worlds
 from judged import formatting
@@ -21,6 +23,10 @@ class JudgedError(Exception):
         self.message = message
         self.context = context
 
+    def __reduce__(self):
+        # allows errors to be sent back from worker processes
+        return (type(self), (self.message, self.context))
+
 
 class SafetyError(JudgedError):
     """
@@ -74,7 +80,7 @@ class Constant(metaclass=interned.InternalizeMeta, key=constant_key):
 
     def tag(self, i, env):
         """A constant's tag is itself."""
-        return self.id
+        return self
 
     def subst(self, env):
         """Substitution of a constant retains the constant."""
@@ -138,13 +144,12 @@ class Variable(metaclass=interned.InternalizeMeta):
 
     def tag(self, i, env):
         """
-        A variable's tag is the tag already present for it, or the tag term 'i'
+        A variable's tag is the tag already present for it, or the position 'i'
         given to it by the tagging process.
         """
         result = env.get(self)
-        if not result:
-            result = 'v' + str(i)
-            env[self] = result
+        if result is None:
+            result = env[self] = i
         return result
 
     def subst(self, env):
@@ -203,11 +208,17 @@ def make_fresh_var():
     guarantee is given by automaticall incrementing the numeric identifier used
     to create a variable.
     """
-    make_fresh_var.counter += 1
-    return Variable('_' + str(make_fresh_var.counter))
+    with _fresh_lock:
+        make_fresh_var.counter += 1
+        number = make_fresh_var.counter
+    return Variable('_' + str(number))
 
 make_fresh_var.counter = 0
 
+# Guards the counter of fresh variables, as provers on several threads rename
+# clauses apart at the same time.
+_fresh_lock = threading.Lock()
+
 
 class Predicate(metaclass=interned.InternalizeMeta):
     """
@@ -228,23 +239,21 @@ class Predicate(metaclass=interned.InternalizeMeta):
         return self.id
 
 
-def add_size(string):
-    """Helper function for tag creation."""
-    return str(len(string)) + ':' + string
-
-
 class Literal:
     """
     A literal consists of a predicate and a list of terms. The literal
     behaves as a sequence with respect to it's terms. Additionally, it
     exposes the pred, id, and tag properties.
     """
+    __slots__ = ('pred', 'terms', 'polarity', '_id', '_tag', '_hash')
+
     def __init__(self, pred, terms, polarity=True):
         self.pred = pred
         self.terms = terms
         self.polarity = polarity
         self._id = None
         self._tag = None
+        self._hash = None
 
     def __str__(self):
         return format(self, 'plain')
@@ -271,33 +280,38 @@ class Literal:
             return False
 
     def __hash__(self):
-        return hash(self.id)
+        result = self._hash
+        if result is None:
+            result = self._hash = hash(self.id)
+        return result
+
+    def __reduce__(self):
+        # the cached hash depends on the identities of the interned terms, so
+        # it is not carried over to other processes
+        return (Literal, (self.pred, self.terms, self.polarity))
 
     @property
     def id(self):
-        """Determines a unique id for the literal."""
+        """
+        Determines a unique id for the literal, which is a tuple of the
+        polarity, the interned predicate and the interned terms.
+        """
         result = self._id
-        if not result:
-            polarity = '' if self.polarity else '~'
-            result = polarity + add_size(self.pred.id)
-            for t in self:
-                result += add_size(t.id)
-            self._id = result
+        if result is None:
+            result = self._id = (self.polarity, self.pred, *self.terms)
         return result
 
     def tag(self):
         """
         Determines a tag for the literal. The tags of two literals are equal if
-        the two literals are structurally the same.
+        the two literals are structurally the same. Constants are kept in the
+        tag, while each variable is replaced by the position of its first
+        occurrence.
         """
         result = self._tag
-        if not result:
+        if result is None:
             env = dict()
-            polarity = '' if self.polarity else '~'
-            result = polarity + add_size(self.pred.id)
-            for i in range(len(self)):
-                result += add_size(self[i].tag(i, env))
-            self._tag = result
+            result = self._tag = (self.polarity, self.pred, *(t.tag(i, env) for i, t in enumerate(self.terms)))
         return result
 
     def subst(self, env):
@@ -369,12 +383,15 @@ class Clause:
     The clause acts as a set with respect to the literals found in delayed and
     body.
     """
+    __slots__ = ('head', 'body', 'delayed', 'sentence', '_id', '_hash')
+
     def __init__(self, head, body=[], delayed=[], sentence=worlds.Top()):
         self.head = head
         self.body = body
         self.delayed = delayed
         self.sentence = sentence
         self._id = None
+        self._hash = None
 
     def __str__(self):
         return format(self, 'plain')
@@ -399,21 +416,25 @@ class Clause:
             return False
 
     def __hash__(self):
-        return hash(self.id)
+        result = self._hash
+        if result is None:
+            result = self._hash = hash(self.id)
+        return result
+
+    def __reduce__(self):
+        # see Literal.__reduce__
+        return (Clause, (self.head, self.body, self.delayed, self.sentence))
 
     @property
     def id(self):
-        """Determine a unique string representation."""
+        """
+        Determine a unique id for the clause, which is a tuple of the head,
+        the body and delayed literals, and the key of the sentence. The
+        literals keep their own hashes, so the id is cheap to hash.
+        """
         result = self._id
-        if not result:
-            result = add_size(self.head.id)
-            for lit in self.body:
-                result += add_size(lit.id)
-            result += '|'
-            for lit in self.delayed:
-                result += add_size(lit.id)
-            result += '%' + add_size(repr(self.sentence))
-            self._id = result
+        if result is None:
+            result = self._id = (self.head, tuple(self.body), tuple(self.delayed), self.sentence.key())
         return result
 
     def subst(self, env):
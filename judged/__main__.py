@@ -12,6 +12,7 @@ from judged import logic
 from judged import formatting
 from judged import worlds
 from judged import extensions
+from judged import snapshot
 
 import sys
 import os
@@ -61,6 +62,8 @@ class ActionReporter:
             print('  ' * self.indent + "{}.".format(a.clause), end='')
             if a.probability is not None:
                 print('  ' * self.indent + formatting.comment(" % p = {}".format(a.probability)), end='')
+                if a.variance is not None:
+                    print(formatting.comment(", variance = {}".format(a.variance)), end='')
             print()
 
     def enter(self, action):
@@ -77,7 +80,10 @@ def handle_reader(reader):
     information of the parsed action.
     """
     # parse the compound action from the reader
-    compound = parser.parse(reader)
+    if args.load_facts:
+        compound = parser.parse_bulk(reader)
+    else:
+        compound = parser.parse(reader)
     # set up the CLI reporter
     reporter =  ActionReporter(args)
 
@@ -103,7 +109,8 @@ def batch(readers):
             handle_reader(reader)
         except judged.JudgedError as e:
             print("{}{}: {}".format(reader.name, e.context, e.message))
-            break
+            return False
+    return True
 
 
 def interactive():
@@ -285,6 +292,12 @@ def main():
                          help='Increases verbosity for all questions. Outputs each question before answering.')
     shared_options.add_argument('-d', '--debug', default=False, action='store_true',
                          help='Enables debugging output.')
+    shared_options.add_argument('--load-facts', default=False, action='store_true',
+                         help='Loads the input in bulk. Consecutive ground facts are asserted at once, without checking each of them separately.')
+    shared_options.add_argument('--load-snapshot', metavar='SNAPSHOT',
+                         help='Loads a snapshot of the knowledge base before processing the input files.')
+    shared_options.add_argument('--save-snapshot', metavar='SNAPSHOT',
+                         help='Saves a snapshot of the knowledge base after processing the input files.')
     shared_options.add_argument('-e', '--extension', action='append', default=[], dest='extensions',
                          help='Names of python modules to import for extension loading.')
 
@@ -294,7 +307,7 @@ def main():
     shared_options.add_argument('-f', '--format', choices=('plain','color','html'), default=format_default,
                          help='Selects output format. Defaults to the value of the '+FORMAT_ENV_KEY+' environment variable if set, \'plain\' if it is not set or if the output is piped.')
     # FIXME: Usability feature for later (used in MC branch)
-    # shared_options.add_argument('-j', '--json', default=False, action='store_true',
+    # shared_options.add_argument('--json', default=False, action='store_true',
     #                      help='Output query answers in JSON format.')
 
     # build actual options
@@ -307,6 +320,8 @@ def main():
     deterministic_options = suboptions.add_parser('deterministic', aliases=['det'], parents=[shared_options],
                          help='Use the deterministic judged prover')
     deterministic_options.set_defaults(type='deterministic')
+    deterministic_options.add_argument('-p', '--prover', choices=sorted(context.DeterministicContext.provers), default='slg',
+                         help='Selects the prover: top-down \'slg\' resolution or bottom-up \'seminaive\' evaluation of stratified programs. Defaults to %(default)s.')
 
     # FIXME: Get world selection working
     # deterministic_options.add_argument('-s', '--select', nargs='*',
@@ -327,6 +342,22 @@ def main():
                          help='The maximum number of simulation runs to do. A value of zero means no maximum. Defaults to %(default)s.')
     montecarlo_options.add_argument('-a', '--approximate', type=float, default=0,
                          help='The maximum allowable error for an approximation simulation. Defaults to %(default)s.')
+    montecarlo_options.add_argument('-p', '--precision', type=float, default=None,
+                         help='Stops the simulation once the confidence interval around the probability of each answer reaches at most this far from the estimate.')
+    montecarlo_options.add_argument('-c', '--confidence', type=float, default=0.95,
+                         help='The confidence level of the confidence intervals. Defaults to %(default)s.')
+    montecarlo_options.add_argument('--check-every', type=int, default=100,
+                         help='The number of simulation runs between checks whether the simulation can stop. Defaults to %(default)s.')
+    montecarlo_options.add_argument('-j', '--jobs', type=int, default=1,
+                         help='The number of worker processes to divide the simulation runs over. Defaults to %(default)s.')
+    montecarlo_options.add_argument('-s', '--seed', type=int, default=None,
+                         help='Seeds the random choices to make the simulation reproducible.')
+    montecarlo_options.add_argument('-l', '--lineage', default=False, action='store_true',
+                         help='Derives the sentence of each answer once, and evaluates it in each simulation run instead of proving the query again. Does not handle negation.')
+    montecarlo_options.add_argument('-S', '--strategy', choices=sorted(context.MontecarloContext.strategies), default='plain',
+                         help='Selects how worlds are sampled: \'plain\' sampling, \'stratified\' sampling over the partitionings with the highest entropy, or \'importance\' sampling biased towards the labels the answers need. All but plain sampling imply --lineage. Defaults to %(default)s.')
+    montecarlo_options.add_argument('-b', '--batch', type=int, default=0,
+                         help='Samples worlds in batches of the given size with NumPy, and evaluates the sentences of the answers for a whole batch at once. Implies --lineage. Defaults to %(default)s, which disables batching.')
 
     # Parse actual arguments
     args = options.parse_args()
@@ -366,15 +397,32 @@ def main():
 
     # construct context
     if args.type == 'deterministic':
-        current_context = context.DeterministicContext(**context_options)
+        current_context = context.DeterministicContext(prover=args.prover, **context_options)
     elif args.type == 'exact':
         current_context = context.ExactContext(**context_options)
     elif args.type == 'montecarlo':
-        current_context = context.MontecarloContext(number=args.number, approximate=args.approximate, **context_options)
+        try:
+            current_context = context.MontecarloContext(number=args.number, approximate=args.approximate, jobs=args.jobs, seed=args.seed, lineage=args.lineage, batch=args.batch,
+                                                         precision=args.precision, confidence=args.confidence, check_every=args.check_every,
+                                                         strategy=args.strategy,
+                                                         **context_options)
+        except judged.JudgedError as e:
+            print("Error: {}".format(e.message))
+            options.exit(1)
+
+    # load the snapshot before anything else
+    if args.load_snapshot:
+        try:
+            snapshot.load(current_context, args.load_snapshot)
+        except (judged.JudgedError, OSError) as e:
+            print("Error: Could not load the snapshot '{}': {}".format(args.load_snapshot, getattr(e, 'message', e)))
+            options.exit(1)
 
     # run files and drop to interactive mode if requested
     if args.file:
-        batch(args.file)
+        succeeded = batch(args.file)
+        if succeeded and args.save_snapshot:
+            snapshot.save(current_context, args.save_snapshot)
         if args.imports:
             interactive()
     else:
@@ -33,6 +33,21 @@ class AssertAction(Action):
         return cls(self.clause.subst(env), source=self.source)
 
 
+class AssertFactsAction(Action):
+    def __init__(self, clauses, *, source=None):
+        super().__init__(source)
+        self.clauses = clauses
+
+    def perform(self, context, reporter=None):
+        if reporter is not None:
+            reporter.perform(self)
+
+        context.knowledge.assert_facts(self.clauses)
+
+    def __str__(self):
+        return "assert {} facts".format(len(self.clauses))
+
+
 class RetractAction(Action):
     def __init__(self, clause, *, source=None):
         super().__init__(source)
@@ -162,7 +177,7 @@ class UsePredicateAction(Action):
         ext = context.extensions.get(self.module)
         if not ext:
             ext = UseModuleAction(self.module, {}).perform(context)
-        ext.register_predicate(context, self.predicate, self.alias)
+        context.use_predicate(ext, self.predicate, self.alias)
 
     def __str__(self):
         return "use predicate '{}' from module '{}'".format(self.predicate, self.module) + (" aliased as '{}'".format(self.alias) if self.alias else '')
@@ -4,13 +4,21 @@ Binary Decision Diagram module.
 
 from judged.interned import InternalizeMeta
 from operator import attrgetter
+import threading
 
 
 class Node(metaclass=InternalizeMeta):
+    """
+    A decision node. Nodes are interned on (root, high, low), so the class
+    lookup acts as the unique table: structurally equal diagrams are the same
+    object, and can be compared by identity.
+    """
     def __init__(self, root, high, low):
         self._root = root
         self._high = high
         self._low = low
+        # cached negation of this node
+        self._neg = None
 
     def __repr__(self):
         return self.__class__.__name__ + "(root={}, high={}, low={})".format(self.root, self.high, self.low)
@@ -19,9 +27,45 @@ class Node(metaclass=InternalizeMeta):
     high = property(attrgetter('_high'))
     low = property(attrgetter('_low'))
 
+    # interned nodes compare by identity, use the builtin implementations for
+    # speed as nodes are hashed for every computed table lookup
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
 
 ZERO = Node(-1, None, None)
 ONE = Node(-2, None, None)
+ZERO._neg = ONE
+ONE._neg = ZERO
+
+
+# The computed table of the ITE operator is a lossy, direct-mapped cache: each
+# (f, g, h) triple has exactly one slot, and a new result simply evicts
+# whatever was stored in that slot before. This bounds the memory use while
+# keeping lookups O(1).
+_computed = []
+_mask = 0
+
+
+def set_cache_size(size):
+    """
+    Sets the number of slots in the computed table, which must be a power of
+    two. This clears the computed table.
+    """
+    global _computed, _mask
+    if size < 1 or size & (size - 1):
+        raise ValueError("Cache size must be a power of two, not {}".format(size))
+    _computed = [None] * size
+    _mask = size - 1
+
+
+def clear_caches():
+    """Clears the computed table."""
+    set_cache_size(len(_computed))
+
+
+set_cache_size(2**16)
 
 
 def _node(root, high, low):
@@ -32,15 +76,25 @@ def _node(root, high, low):
 
 
 def _neg(node):
-    if node is ZERO:
-        # ~0 = 1
-        return ONE
-    elif node is ONE:
-        # ~1 = 0
-        return ZERO
-    else:
+    result = node._neg
+    if result is None:
         # ~(f -> g,h) = f -> ~g, ~h
-        return _node(node.root, _neg(node.high), _neg(node.low))
+        result = _node(node.root, _neg(node.high), _neg(node.low))
+        node._neg = result
+        result._neg = node
+    return result
+
+
+def _cofactors(node, root):
+    """
+    Determines the positive and negative cofactors of the node with respect
+    to the variable root, which must not come after the node's own variable in
+    the ordering.
+    """
+    if node.root == root:
+        return node.high, node.low
+    else:
+        return node, node
 
 
 def _ite(f, g, h):
@@ -49,14 +103,8 @@ def _ite(f, g, h):
 
     This function applies the operator to already represented nodes.
     """
-    # f -> 1, 0 = f
-    if g is ONE and h is ZERO:
-        return f
-    # f -> 0, 1 = ~f
-    elif g is ZERO and h is ONE:
-        return _neg(f)
     # 1 -> g, h = g
-    elif f is ONE:
+    if f is ONE:
         return g
     # 0 -> g, h = h
     elif f is ZERO:
@@ -64,14 +112,40 @@ def _ite(f, g, h):
     # f -> g, g = g
     elif g is h:
         return g
+    # f -> 1, 0 = f
+    elif g is ONE and h is ZERO:
+        return f
+    # f -> 0, 1 = ~f
+    elif g is ZERO and h is ONE:
+        return _neg(f)
+
+    # f -> f, h = f -> 1, h and f -> g, f = f -> g, 0
+    if g is f:
+        g = ONE
+    if h is f:
+        h = ZERO
+
+    key = (f, g, h)
+    slot = hash(key) & _mask
+    entry = _computed[slot]
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
     # f -> g, h = x -> (fx -> gx, hx), (fx' -> gx', hx')
-    else:
-        # Order variables (to obtain Ordered BDD), skip ZERO and ONE' magic
-        # numbers -1 and -2.
-        root = min(n.root for n in (f, g, h) if not n.root < 0)
-        f1, g1, h1 = [_restrict(n, {root: ONE}) for n in (f, g, h)]
-        f0, g0, h0 = [_restrict(n, {root: ZERO}) for n in (f, g, h)]
-        return _node(root, _ite(f1, g1, h1), _ite(f0, g0, h0))
+    # split on the first variable in the ordering, skipping the negative roots
+    # of ZERO and ONE (f is never a constant here)
+    root = f.root
+    if 0 <= g.root < root:
+        root = g.root
+    if 0 <= h.root < root:
+        root = h.root
+    f1, f0 = _cofactors(f, root)
+    g1, g0 = _cofactors(g, root)
+    h1, h0 = _cofactors(h, root)
+    result = _node(root, _ite(f1, g1, h1), _ite(f0, g0, h0))
+
+    _computed[slot] = (key, result)
+    return result
 
 
 def _restrict(node, point):
@@ -88,6 +162,30 @@ def _restrict(node, point):
         return _node(node.root, _restrict(node.high, point), _restrict(node.low, point))
 
 
+def _count(node, weights, memo):
+    # the nodes are counted in post-order with an explicit stack, as the
+    # diagram can be deeper than the recursion limit
+    memo[ONE] = 1.0
+    memo[ZERO] = 0.0
+    stack = [node]
+    while stack:
+        current = stack[-1]
+        if current in memo:
+            stack.pop()
+            continue
+        high, low = current.high, current.low
+        if high in memo and low in memo:
+            positive, negative = weights[current.root]
+            memo[current] = positive * memo[high] + negative * memo[low]
+            stack.pop()
+        else:
+            if high not in memo:
+                stack.append(high)
+            if low not in memo:
+                stack.append(low)
+    return memo[node]
+
+
 # FIXME: Should these be collapsed into _node?
 class BDD:
     """
@@ -99,6 +197,16 @@ class BDD:
     def restrict(self, point):
         return BDD(_restrict(self.node, point))
 
+    def weighted_count(self, weights):
+        """
+        Determines the weighted model count of the diagram in a single pass
+        over its nodes. The weights map each variable to a pair of weights for
+        its positive and negative assignment. Variables that are skipped on a
+        path contribute nothing, so they must either have weights summing to 1
+        or be tested on every path leading to ONE.
+        """
+        return _count(self.node, weights, {})
+
     def is_zero(self):
         return self.node == ZERO
 
@@ -158,15 +266,36 @@ def constant(val):
         return BDD(ZERO)
 
 
+def exactly_one(bdds):
+    """
+    Creates the diagram that holds if and only if exactly one of the given
+    variables holds. The diagram is built bottom-up along the variable
+    ordering, which takes linear time and gives a diagram of linear size.
+    """
+    roots = sorted({b.node.root for b in bdds}, reverse=True)
+    # none holds if no variable below the current one holds, one holds if
+    # exactly one does
+    none = ONE
+    one = ZERO
+    for root in roots:
+        one = _node(root, none, one)
+        none = _node(root, ZERO, none)
+    return BDD(one)
+
+
 variables = {}
 variables_rev = {}
+_variables_lock = threading.Lock()
 
 
 def variable(name):
     try:
         identifier = variables_rev[name]
     except KeyError:
-        identifier = len(variables)
-        variables[identifier] = name
-        variables_rev[name] = identifier
+        with _variables_lock:
+            identifier = variables_rev.get(name)
+            if identifier is None:
+                identifier = len(variables)
+                variables[identifier] = name
+                variables_rev[name] = identifier
     return BDD(_node(identifier, ONE, ZERO))
@@ -4,13 +4,28 @@ Execution context for a JudgeD program.
 
 import random
 import collections
+import concurrent.futures
 import contextlib
+import functools
+import itertools
+import multiprocessing
+import os
+import queue
+import statistics
 
 from judged.logic import Knowledge, Prover,  ExactProver
-from judged import JudgedError
+from judged.seminaive import SeminaiveProver
+from judged import JudgedError, Clause
+from judged import worlds
+from judged import sampling
 
 
-Answer = collections.namedtuple('Answer', ['clause', 'probability'])
+Answer = collections.namedtuple('Answer', ['clause', 'probability', 'variance'], defaults=[None])
+
+# Records of the extensions used by a context, and of the predicates
+# registered from them
+ModuleUse = collections.namedtuple('ModuleUse', ['module', 'config'])
+PredicateUse = collections.namedtuple('PredicateUse', ['module', 'predicate', 'alias'])
 
 
 class Result:
@@ -25,7 +40,10 @@ class Context:
     def __init__(self, knowledge, prover):
         self.knowledge = knowledge
         self.prover = prover
+        # the provers of the worker threads of ask_many
+        self.prover_pool = []
         self.extensions = {}
+        self.uses = []
         self.prob = {}
 
     def add_probability(self, partitioning, part, prob):
@@ -58,10 +76,61 @@ class Context:
                 # create and register extension ask context helper
                 ext_stack.enter_context(self._ask_extension(ext))
             # with all extension ask contexts ready, fire the real ask
-            return self._ask(query)
+            with self.knowledge.lock.reading():
+                return self._ask(query)
 
-    def _ask(self, query):
-        answers = self.prover.ask(query, self.check)
+    def ask_many(self, queries, workers=None):
+        """
+        Answers the queries concurrently with a pool of worker threads. Each
+        worker has a prover of its own over the shared knowledge base, which
+        is kept for later calls. Changes to the knowledge base wait until the
+        running queries are done. Returns the results in the order of the
+        queries.
+
+        Contexts that can not create more provers answer the queries one after
+        the other.
+        """
+        queries = list(queries)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1:
+            raise JudgedError("The number of workers must be at least 1, not {}.".format(workers))
+
+        while len(self.prover_pool) < min(workers, len(queries)):
+            prover = self.new_prover()
+            if prover is None:
+                return [self.ask(q) for q in queries]
+            self.prover_pool.append(prover)
+
+        idle = queue.SimpleQueue()
+        for prover in self.prover_pool:
+            idle.put(prover)
+
+        def answer(query):
+            prover = idle.get()
+            try:
+                with self.knowledge.lock.reading():
+                    return self._ask(query, prover)
+            finally:
+                idle.put(prover)
+
+        # the extensions see all queries as a single ask
+        with contextlib.ExitStack() as ext_stack:
+            for ext in self.extensions.values():
+                ext_stack.enter_context(self._ask_extension(ext))
+            with concurrent.futures.ThreadPoolExecutor(len(self.prover_pool)) as executor:
+                return list(executor.map(answer, queries))
+
+    def new_prover(self):
+        """
+        Creates another prover over the knowledge base for concurrent queries,
+        or returns None if the context answers one query at a time.
+        """
+        return None
+
+    def _ask(self, query, prover=None):
+        prover = prover or self.prover
+        answers = prover.ask(query, self.check)
         return Result([Answer(a, None) for a in answers])
 
     def use_extension(self, extension, config):
@@ -69,16 +138,36 @@ class Context:
         extension._do_setup(self, config)
         # if none of the above failed, we add the extension
         self.extensions[extension.name] = extension
+        self.uses.append(ModuleUse(extension.name, dict(config)))
+
+    def use_predicate(self, extension, predicate, alias=None):
+        # register the predicate, or all predicates if none is given
+        extension.register_predicate(self, predicate, alias)
+        self.uses.append(PredicateUse(extension.name, predicate, alias))
 
 
 class DeterministicContext(Context):
     tagline = 'deterministic variant'
 
-    def __init__(self, debugger=None):
+    # The selectable provers for the deterministic variant
+    provers = {
+        'slg': functools.partial(Prover, reuse_tables=True),
+        'seminaive': SeminaiveProver
+    }
+
+    def __init__(self, debugger=None, prover='slg'):
         knowledge = Knowledge(self)
-        super().__init__(knowledge, Prover(knowledge, debugger=debugger))
+        try:
+            self.prover_type = self.provers[prover]
+        except KeyError:
+            raise JudgedError("Unknown prover '{}', use one of: {}".format(prover, ', '.join(self.provers)))
+        self.debugger = debugger
+        super().__init__(knowledge, self.prover_type(knowledge, debugger=debugger))
         self.choices = {}
 
+    def new_prover(self):
+        return self.prover_type(self.knowledge, debugger=self.debugger)
+
     def check(self, key, part):
         try:
             self.choices[key] == part
@@ -90,9 +179,13 @@ class DeterministicContext(Context):
 
     def select_world_set(self, key, part):
         self.choices[key] = part
+        for prover in [self.prover] + self.prover_pool:
+            prover.invalidate()
 
     def reset_world_set(self):
         self.choices.clear()
+        for prover in [self.prover] + self.prover_pool:
+            prover.invalidate()
 
 
 class ExactContext(Context):
@@ -100,86 +193,369 @@ class ExactContext(Context):
 
     def __init__(self, debugger=None):
         knowledge = Knowledge(self)
-        super().__init__(knowledge, ExactProver(knowledge, debugger=debugger))
+        self.debugger = debugger
+        super().__init__(knowledge, ExactProver(knowledge, debugger=debugger, reuse_tables=True))
+
+    def new_prover(self):
+        return ExactProver(self.knowledge, debugger=self.debugger, reuse_tables=True)
 
     def check(self, key, part):
         # NOTE: This can be used to allow "conditioned queries" by restricting the world set
         return True
 
+    def _ask(self, query, prover=None):
+        prover = prover or self.prover
+        answers = prover.ask(query, self.check)
+        return Result([Answer(a, worlds.probability(a.sentence, self.knowledge, self.prob)) for a in answers])
+
+
+# The context and query sampled by the worker processes of a parallel Monte
+# Carlo simulation. The workers are forked, so they inherit these together with
+# a copy of the knowledge base.
+_sampling = None
+
+
+def _sample(task):
+    """Runs a share of the simulation runs in a worker process."""
+    seed, iterations = task
+    context, query = _sampling
+    context.random.seed(seed)
+    return context.sample(query, iterations)
+
+
+class Estimate:
+    """
+    The statistics of a Monte Carlo simulation, kept up to date as the tallies
+    of runs come in.
+
+    The probability of an answer is estimated for each stratum by the mean
+    weight of the runs in that stratum, and these are combined according to
+    the probabilities of the strata. Its variance is estimated the same way.
+
+    The error is the root mean square difference between the exact and the
+    estimated probability of each world encountered. It is maintained through
+    running sums, so that it can be determined in constant time. The precision
+    is the half-width of the widest confidence interval around the estimated
+    probability of any answer, at the given confidence level, and the width
+    gives this half-width for a single answer. For unweighted runs, these are
+    Wilson score intervals.
+    """
+    def __init__(self, prob, confidence, strata=None, weighted=False):
+        self.prob = prob
+        self.z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        self.strata = strata if strata is not None else {(): 1.0}
+        self.weighted = weighted
+        self.count = 0
+        # the answers in the order they were found, and for each stratum the
+        # runs and the sums of weights and squared weights of each answer
+        self.answers = dict()
+        self.runs = collections.Counter()
+        self.sums = {}
+        self.sums2 = {}
+        self.worlds = collections.Counter()
+        # exact probability of each world, and the running sums of the squared
+        # exact probabilities, of the exact probabilities times the counts, and
+        # of the squared counts over all worlds
+        self.exact = {}
+        self.squares = 0.0
+        self.products = 0.0
+        self.counts = 0
+
+    def update(self, tally):
+        """Adds the tally of a number of runs."""
+        self.runs.update(tally.runs)
+        self.count += sum(tally.runs.values())
+        for stratum, sums in tally.answers.items():
+            self.sums.setdefault(stratum, collections.Counter()).update(sums)
+            for a in sums:
+                self.answers[a] = None
+        for stratum, sums in tally.squares.items():
+            self.sums2.setdefault(stratum, collections.Counter()).update(sums)
+
+        for world, n in tally.worlds.items():
+            exact = self.exact.get(world)
+            if exact is None:
+                exact = 1.0
+                for p, v in world:
+                    exact *= self.prob[p][v]
+                self.exact[world] = exact
+                self.squares += exact * exact
+            c = self.worlds[world]
+            self.worlds[world] = c + n
+            self.products += exact * n
+            self.counts += (c + n) * (c + n) - c * c
+
+    def probability(self, answer):
+        result = 0.0
+        for stratum, n in self.runs.items():
+            result += self.strata[stratum] * self.sums.get(stratum, {}).get(answer, 0) / n
+        return result
+
+    def variance(self, answer):
+        """Estimates the variance of the estimated probability of the answer."""
+        result = 0.0
+        for stratum, n in self.runs.items():
+            mean = self.sums.get(stratum, {}).get(answer, 0) / n
+            spread = self.sums2.get(stratum, {}).get(answer, 0) / n - mean * mean
+            result += self.strata[stratum]**2 * max(spread, 0.0) / n
+        return result
+
+    def error(self):
+        n = self.count
+        # sum of (exact - c/n)**2 over all worlds, expanded
+        result = self.squares - 2 * self.products / n + self.counts / (n * n)
+        result /= len(self.worlds)
+        return max(result, 0.0)**0.5
+
+    def interval(self, p):
+        """Determines the half-width of the Wilson score interval around p."""
+        n = self.count
+        z2 = self.z * self.z
+        return self.z / (1 + z2 / n) * (p * (1 - p) / n + z2 / (4 * n * n))**0.5
+
+    def width(self, answer):
+        """Determines the half-width of the confidence interval of the answer."""
+        if self.weighted:
+            return self.z * self.variance(answer)**0.5
+        else:
+            return self.interval(self.probability(answer))
+
+    def precision(self):
+        # answers that were not encountered yet are accounted for by the
+        # interval around 0
+        return max([self.interval(0.0)] + [self.width(a) for a in self.answers])
+
 
 class MontecarloContext(Context):
     tagline = 'monte carlo variant'
 
-    def __init__(self, number=1000, approximate=0, debugger=None):
+    # The maximum number of runs given to a worker at once, after each round of
+    # shares the approximation error is checked
+    share_size = 1000
+
+    # The selectable sampling schemes, all but plain sampling need lineage
+    strategies = {
+        'plain': sampling.PlainSampling,
+        'stratified': sampling.StratifiedSampling,
+        'importance': sampling.ImportanceSampling
+    }
+
+    def __init__(self, number=1000, approximate=0, debugger=None, jobs=1, seed=None, lineage=False, batch=0,
+                 precision=None, confidence=0.95, check_every=100, strategy='plain'):
         knowledge = Knowledge(self)
         super().__init__(knowledge, Prover(knowledge, debugger=debugger))
+        if strategy not in self.strategies:
+            raise JudgedError("Unknown sampling strategy '{}', use one of: {}".format(strategy, ', '.join(self.strategies)))
+        self.strategy = strategy
+        # batched sampling evaluates the lineage of the answers, and needs NumPy
+        if batch and not sampling.available:
+            raise JudgedError("Batched sampling needs NumPy, which is not installed.")
+        if batch and strategy != 'plain':
+            raise JudgedError("Batched sampling only supports the plain sampling strategy.")
+        self.batch = batch
+        # the lineage prover derives the sentences of all answers once, after
+        # which each run only evaluates them
+        self.lineage_prover = None
+        if lineage or batch or strategy != 'plain':
+            self.lineage_prover = ExactProver(knowledge, debugger=debugger, reuse_tables=True)
+        self.derived = None
+        self.sampler = None
+        # the sampling scheme of the current query in lineage mode, and the
+        # number of runs done for each of its strata
+        self.scheme = None
+        self.allocated = collections.Counter()
+        self.weight = 1.0
         self.choices = {}
         self.number = number
         self.approximate = approximate
+        self.precision = precision
+        if not 0 < confidence < 1:
+            raise JudgedError("The confidence level must be between 0 and 1, not {}.".format(confidence))
+        self.confidence = confidence
+        if check_every < 1:
+            raise JudgedError("The number of runs between convergence checks must be at least 1, not {}.".format(check_every))
+        self.check_every = check_every
+        if jobs < 1:
+            raise JudgedError("The number of jobs must be at least 1, not {}.".format(jobs))
+        self.jobs = jobs
+        self.random = random.Random(seed)
+        # alias tables for drawing the parts of each partitioning
+        self.tables = {}
 
     def check(self, key, part):
         if key not in self.choices:
             self.choices[key] = self.pick(key)
         return self.choices[key] == part
 
-    def pick(self, partitioning):
+    def add_probability(self, partitioning, part, prob):
+        super().add_probability(partitioning, part, prob)
+        self.tables.pop(partitioning, None)
+
+    def table(self, partitioning):
         """
-        Randomly picks a partition based on the known partitions. The selection
-        is weighted by the assigned probabilities.
+        Determines the alias table for the partitioning. The table is built,
+        and the distribution validated, once after the probabilities of the
+        partitioning were last changed.
         """
-        r = random.random()
-        a = 0.0
         try:
-            for part, prob in self.prob[partitioning].items():
-                a += prob
-                if a >= r:
-                    return part
-            raise JudgedError("Probabilities for partitioning '{}' do not sum to 1.0.".format(partitioning))
-        except:
+            return self.tables[partitioning]
+        except KeyError:
+            pass
+        try:
+            probs = self.prob[partitioning]
+        except KeyError:
             raise JudgedError("Probabilities for partitioning '{}' not set".format(partitioning))
+        if any(p < 0 for p in probs.values()) or abs(sum(probs.values()) - 1.0) > 1e-6:
+            raise JudgedError("Probabilities for partitioning '{}' do not sum to 1.0.".format(partitioning))
+        result = self.tables[partitioning] = sampling.AliasTable(probs)
+        return result
 
-    def _ask(self, query):
-        for ext in self.extensions:
-            ext._do_before_ask(self)
-
-        count = 0
-        worlds = collections.Counter()
-        answers = collections.Counter()
-
-        def p(c):
-            return c / count
-
-        def exact(w):
-            result = 1
-            for p,v in w:
-                result *= self.prob[p][v]
-            return result
+    def pick(self, partitioning):
+        """
+        Randomly picks a partition based on the known partitions. The selection
+        is weighted by the assigned probabilities, unless the sampling scheme
+        of the query biases it.
+        """
+        if self.scheme is not None:
+            return self.scheme.pick(self, partitioning)
+        return self.table(partitioning).draw(self.random)
 
-        def error():
-            result = 0
-            for w in worlds:
-                result += (exact(w) - p(worlds[w]))**2
-            result /= len(worlds)
-            return result**0.5
+    def possible(self, key, part):
+        # Used to derive lineage: the sentences are built for all worlds
+        return True
 
-        while self.number == 0 or count < self.number:
-            count += 1
+    def lineage(self, query):
+        """
+        Derives the answers to the query, each with the sentence describing the
+        worlds in which it holds. The lineage is derived once for each ask.
+        """
+        if self.derived is None:
+            self.derived = [(Clause(a.head, [], []), a.sentence) for a in self.lineage_prover.ask(query, self.possible)]
+        return self.derived
 
+    def sample(self, query, iterations):
+        """
+        Performs the given number of simulation runs. Returns the tally of the
+        runs.
+        """
+        tally = sampling.Tally()
+        if self.batch:
+            if self.sampler is None:
+                self.sampler = sampling.BatchSampler(self.lineage(query), self.prob)
+            rng = sampling.generator(self.random)
+            for start in range(0, iterations, self.batch):
+                self.sampler.sample(rng, min(self.batch, iterations - start), tally)
+            return tally
+
+        if self.scheme is not None:
+            lineage = self.lineage(query)
+            def run():
+                return [a for a, sentence in lineage if sentence.evaluate(self.check)]
+            strata = self.scheme.allocate(self.allocated, iterations)
+        else:
+            def run():
+                return list(self.prover.ask(query, self.check))
+            strata = itertools.repeat((), iterations)
+
+        for stratum in strata:
             self.choices.clear()
-            answer = list(self.prover.ask(query, self.check))
-            world = frozenset(self.choices.items())
+            self.choices.update(stratum)
+            self.weight = 1.0
+            answer = run()
+            tally.add(stratum, self.weight, answer, frozenset(self.choices.items()))
+        return tally
 
-            for a in answer:
-                answers[a] += 1
-            worlds[world] += 1
-
-            if self.approximate is not None:
-                if error() <= self.approximate:
-                    break
+    def pool(self, query):
+        """
+        Starts the worker processes for a parallel simulation of the query.
+        """
+        global _sampling
+        try:
+            mp = multiprocessing.get_context('fork')
+        except ValueError:
+            raise JudgedError("Parallel simulation needs to fork worker processes, which is not supported on this platform.")
+        _sampling = (self, query)
+        try:
+            return mp.Pool(self.jobs)
+        finally:
+            _sampling = None
 
-        result = Result([Answer(a, p(c)) for a, c in answers.items()], iterations=count, error=error())
+    def shares(self, count):
+        """
+        Divides the next round of simulation runs over the workers, given the
+        number of runs done so far.
+        """
+        total = self.jobs * self.share_size
+        if self.number != 0:
+            total = min(total, self.number - count)
+        size, rest = divmod(total, self.jobs)
+        return [size + 1 if i < rest else size for i in range(self.jobs) if size or i < rest]
 
-        for ext in self.extensions:
-            ext._do_after_ask(self)
+    def step(self, count):
+        """
+        Determines the number of runs in the next step of a simulation without
+        workers, given the number of runs done so far.
+        """
+        if count == 0 or not self.batch:
+            return 1
+        elif self.number == 0:
+            return self.batch
+        else:
+            return min(self.batch, self.number - count)
+
+    def converged(self, estimate):
+        """Determines if the estimate is accurate enough to stop simulating."""
+        if self.approximate is not None and estimate.error() <= self.approximate:
+            return True
+        if self.precision is not None and estimate.precision() <= self.precision:
+            return True
+        return False
 
-        return result
+    def _ask(self, query):
+        count = 0
+        self.derived = None
+        self.sampler = None
+        self.scheme = None
+        self.allocated.clear()
+        if self.lineage_prover is not None and not self.batch:
+            self.scheme = self.strategies[self.strategy](self, self.lineage(query))
+        estimate = Estimate(self.prob, self.confidence,
+                            strata=self.scheme.strata if self.scheme is not None else None,
+                            weighted=self.strategy != 'plain')
+
+        with contextlib.ExitStack() as stack:
+            pool = None
+            # convergence is checked after the first run, and then every
+            # check_every runs
+            check = 1
+            while self.number == 0 or count < self.number:
+                if pool is None:
+                    # the first run is done on its own, so that no workers are
+                    # started for queries that do not depend on any choices
+                    n = self.step(count)
+                    count += n
+                    sampled = [self.sample(query, n)]
+                else:
+                    # each share is given its own seed, drawn in order, so that
+                    # a seeded simulation is reproducible
+                    tasks = [(self.random.getrandbits(64), n) for n in self.shares(count)]
+                    count += sum(n for seed, n in tasks)
+                    sampled = pool.imap_unordered(_sample, tasks)
+
+                for tally in sampled:
+                    estimate.update(tally)
+
+                if count >= check:
+                    check = count + self.check_every
+                    if self.converged(estimate):
+                        break
+
+                if pool is None and self.jobs > 1:
+                    pool = stack.enter_context(self.pool(query))
+
+        return Result([Answer(a, estimate.probability(a), estimate.variance(a)) for a in estimate.answers],
+                        iterations=count,
+                        error=estimate.error(),
+                        precision=estimate.precision(),
+                        widths={str(a): estimate.width(a) for a in estimate.answers},
+                        confidence=self.confidence)
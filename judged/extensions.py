@@ -3,7 +3,13 @@ Extensions module with developer-friendly interface to the extension mechanics
 available in JudgeD.
 """
 
+import asyncio
+import collections
 import functools
+import inspect
+import threading
+import time
+import weakref
 
 import judged
 
@@ -24,6 +30,9 @@ class ExtensionError(judged.JudgedError):
 
 known_extensions = {}
 
+# the event loops that run async predicates, one per thread
+_loops = threading.local()
+
 
 def register_extension(ext):
     """Helper function to register a new extension."""
@@ -39,16 +48,85 @@ def list_extensions():
 
 class PredicateInfo:
     """Plain object to combine information on an extension's predicate."""
-    def __init__(self, name, arity, needs_context, function):
+    def __init__(self, name, arity, needs_context, function, modes=None, batch=False, cache=None, cache_size=1024):
         self.predicate = judged.Predicate(name, arity)
         self.needs_context = needs_context
         self.function = function
+        self.modes = modes
+        self.batch = batch
+        self.cache = cache
+        self.cache_size = cache_size
+        self.is_async = inspect.iscoroutinefunction(function) or inspect.isasyncgenfunction(function)
 
     @property
     def id(self):
         return self.predicate.id
 
 
+class PredicateCache:
+    """
+    A bounded cache of the answers of a predicate, keyed on the bound
+    arguments of a call. The least recently used answers are dropped once the
+    cache is full.
+
+    The scope of the cache is either 'query', to drop all answers after each
+    ask, 'session', to keep them until the cache is invalidated, or 'ttl', to
+    keep each answer for the given number of seconds.
+    """
+    def __init__(self, scope, ttl=None, size=1024):
+        self.scope = scope
+        self.ttl = ttl
+        self.size = size
+        self.entries = collections.OrderedDict()
+        # concurrent queries share the cache
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached answer for the key, or None if there is none."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def parse_cache(spec):
+    """
+    Parses a cache declaration into its scope and time to live.
+    """
+    if spec in ('query', 'session'):
+        return spec, None
+    scope, sep, seconds = str(spec).partition(':')
+    if scope == 'ttl' and sep:
+        try:
+            ttl = float(seconds)
+        except ValueError:
+            ttl = None
+        if ttl is not None and ttl > 0:
+            return scope, ttl
+    raise ExtensionError("Invalid cache '{}', use 'query', 'session' or 'ttl:SECONDS'".format(spec))
+
+
 class Extension:
     """
     The Extension class is instantiated to create an extensions.
@@ -71,12 +149,14 @@ class Extension:
         self.setup_functions = []
         self.before_ask_functions = []
         self.after_ask_functions = []
+        # the caches of registered predicates, per context and predicate
+        self.caches = weakref.WeakKeyDictionary()
         register_extension(self)
 
     def __str__(self):
         return "<judged.extensions.Extension '{}'>".format(self.name)
 
-    def predicate(self, name, arity, needs_context=False):
+    def predicate(self, name, arity, needs_context=False, modes=None, batch=False, cache=None, cache_size=1024):
         """Predicate decorator to register a predicate with the extension.
 
         The predicate decorator requires that the predicate's name and arity are
@@ -87,11 +167,54 @@ class Extension:
         argument, followed by the terms of the literal. If needs_context was
         given, the current context will be givan as an additional, final
         argument.
+
+        Alternatively, the predicate can declare the binding modes it supports
+        with the modes parameter. A mode is a string with a 'b' for each
+        argument that must be bound to a constant, and an 'f' for each argument
+        that may be free, e.g., modes=['bf', 'bb']. The function is then called
+        with the python values of the bound arguments, and None for the free
+        arguments, and produces a tuple of values for each matching row.
+
+        A predicate with binding modes can also ask to be called for many
+        bindings at once by giving batch=True. The function is then called
+        with a list of argument tuples, and returns a list with the rows for
+        each of them, in the same order. Bottom-up evaluation collects the
+        bindings of a whole join into a single call, and top-down evaluation
+        the calls that the answers of a subgoal lead to.
+
+        The answers of expensive predicates can be cached with the cache
+        parameter. With cache='query' the answers are kept until the ask
+        finishes, with cache='session' until the cache is invalidated, and with
+        cache='ttl:SECONDS' for the given number of seconds. Answers are cached
+        per context for each distinct call, i.e., the bound arguments for
+        predicates with binding modes and the literal up to the names of its
+        variables for others. At most
+        cache_size answers are kept, dropping the least recently used ones.
+        Caches can be cleared explicitly with `invalidate`.
+
+        The function may also be an `async def` function, or an async
+        generator, to wait for I/O without blocking. The calls that are
+        collected as for batches are then run concurrently on an event loop,
+        and each other call is run to completion on its own. Predicates called
+        in batches must be `async def` functions.
         """
+        if cache is not None:
+            parse_cache(cache)
+        if cache_size < 1:
+            raise ExtensionError("Cache size for predicate '{}/{}' must be positive".format(name, arity))
+        if modes is not None:
+            for mode in modes:
+                if len(mode) != arity or set(mode) - set('bf'):
+                    raise ExtensionError("Invalid binding mode '{}' for predicate '{}/{}', use a 'b' or 'f' for each argument".format(mode, name, arity))
+        elif batch:
+            raise ExtensionError("Predicate '{}/{}' must declare binding modes to be called in batches".format(name, arity))
+
         # create a registration function for the given parameters
         def predicate_registerer(function):
+            if batch and inspect.isasyncgenfunction(function):
+                raise ExtensionError("Predicate '{}/{}' is called in batches and must return a list of answers, not be an async generator".format(name, arity))
             # create an information piece for this predicate function
-            info = PredicateInfo(name, arity, needs_context, function)
+            info = PredicateInfo(name, arity, needs_context, function, modes, batch, cache, cache_size)
             if info.id in self.predicates:
                 raise ExtensionError("Registering a second '{}' predicate in the '{}' extension".format(info.id, self.name))
             self.predicates[info.id] = info
@@ -120,14 +243,35 @@ class Extension:
     def register_predicate(self, context, full_name, alias=None):
         if full_name is None:
             for pred in self.predicates.values():
-                context.knowledge.add_primitive(pred.predicate, predicate_generator(pred), self.name + '.' + pred.id)
+                self._add_primitive(context, pred, pred.predicate)
         else:
             pred = self._find_predicate(full_name)
             if not pred:
                 raise ExtensionError("No predicate of the name '{}' is present in module '{}'".format(full_name, self.name))
             predicate = pred.predicate if not alias else judged.Predicate(alias, pred.predicate.arity)
-            generator = predicate_generator(pred)
-            context.knowledge.add_primitive(predicate, generator, self.name + '.' + pred.id)
+            self._add_primitive(context, pred, predicate)
+
+    def _add_primitive(self, context, info, predicate):
+        cache = None
+        if info.cache is not None:
+            scope, ttl = parse_cache(info.cache)
+            cache = PredicateCache(scope, ttl, info.cache_size)
+            self.caches.setdefault(context, {})[predicate] = cache
+        generator = predicate_generator(info, cache)
+        batch = predicate_batch(info, cache)
+        context.knowledge.add_primitive(predicate, generator, self.name + '.' + info.id, batch)
+
+    def invalidate(self, context=None, predicate=None):
+        """
+        Clears the cached answers of the extension's predicates. The context
+        and the predicate, given by its name or as 'name/arity', limit the
+        caches that are cleared.
+        """
+        contexts = [context] if context is not None else list(self.caches.keys())
+        for c in contexts:
+            for pred, cache in self.caches.get(c, {}).items():
+                if predicate is None or predicate in (pred.name, pred.id):
+                    cache.clear()
 
     def setup(self, f):
         """Registers a function to run when the extensions is set up for use."""
@@ -148,14 +292,238 @@ class Extension:
     def _do_after_ask(self, context):
         for f in self.after_ask_functions:
             f(context)
+        for cache in self.caches.get(context, {}).values():
+            if cache.scope == 'query':
+                cache.clear()
 
     def _do_setup(self, context, parameters):
         for f in self.setup_functions:
             f(context, **parameters)
 
 
-def predicate_generator(info):
-    if info.needs_context:
+def unwrap(term):
+    """Converts a constant into the python value it stands for."""
+    return term.data if term.data is not None else term.name
+
+
+def wrap(value):
+    """Converts a python value into a constant. Constants are kept as is."""
+    if isinstance(value, judged.Constant):
+        return value
+    elif isinstance(value, (int, float)):
+        return judged.Constant.number(value)
+    elif isinstance(value, str):
+        return judged.Constant.string(value)
+    raise ExtensionError("Can not use {!r} as a constant".format(value))
+
+
+def select_mode(info, literal):
+    """
+    Selects the binding mode of the predicate that binds the most arguments,
+    out of those that only need arguments that the literal binds.
+    """
+    bound = [t.is_const() for t in literal]
+    result = None
+    for mode in info.modes:
+        if all(b or m == 'f' for b, m in zip(bound, mode)):
+            if result is None or mode.count('b') > result.count('b'):
+                result = mode
+    if result is None:
+        raise ExtensionError("None of the binding modes of predicate '{}' ({}) allow the query '{}'".format(info.predicate, ', '.join(info.modes), literal))
+    return result
+
+
+def moded_arguments(info, literal):
+    """
+    Determines the arguments for a call of a predicate with binding modes:
+    the python values of the arguments that the selected mode binds, and None
+    for the others.
+    """
+    mode = select_mode(info, literal)
+    return tuple(unwrap(t) if m == 'b' else None for t, m in zip(literal.terms, mode))
+
+
+def moded_clauses(info, literal, rows):
+    """Produces the clauses for the rows that match the literal."""
+    for row in rows:
+        if len(row) != len(literal):
+            raise ExtensionError("Predicate '{}' produced {!r}, which does not have {} values".format(info.predicate, row, len(literal)))
+        terms = []
+        for term, value in zip(literal.terms, row):
+            if not term.is_const():
+                terms.append(wrap(value))
+            elif unwrap(term) == (unwrap(value) if isinstance(value, judged.Constant) else value):
+                terms.append(term)
+            else:
+                # the row does not match the bound constants
+                break
+        else:
+            yield judged.Clause(judged.Literal(literal.pred, terms))
+
+
+class ThreadLoop:
+    """
+    Holds the event loop of a thread. The loop is closed when the thread
+    exits, as the thread local storage then drops the holder.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+
+    def __del__(self):
+        self.loop.close()
+
+
+def thread_loop():
+    """Determines the event loop of the current thread, created on first use."""
+    holder = getattr(_loops, 'holder', None)
+    if holder is None or holder.loop.is_closed():
+        holder = _loops.holder = ThreadLoop()
+    return holder.loop
+
+
+def run_async(awaitable):
+    """
+    Runs the awaitable to completion on the event loop of the current thread.
+    If the thread already runs an event loop, as when judged is used from
+    async code, the awaitable is run on a worker thread with its own loop
+    instead, as the running loop can not be entered again.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return thread_loop().run_until_complete(awaitable)
+
+    outcome = {}
+    def run():
+        try:
+            outcome['result'] = thread_loop().run_until_complete(awaitable)
+        except BaseException as e:
+            outcome['error'] = e
+    worker = threading.Thread(target=run, name='judged-async')
+    worker.start()
+    worker.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+async def collect(result):
+    """
+    Collects the values produced by an async generator, or by the iterable a
+    coroutine returns, into a list.
+    """
+    if inspect.isasyncgen(result):
+        values = []
+        async for value in result:
+            values.append(value)
+        return values
+    return list(await result)
+
+
+async def gather(results):
+    """Collects the values of several async predicate calls concurrently."""
+    return await asyncio.gather(*[collect(r) for r in results])
+
+
+def call_key(info, literal):
+    """
+    Determines the key that identifies a call of the predicate: the bound
+    arguments for predicates with binding modes, and the tag of the literal
+    otherwise, so that calls that differ only in their variables share a key.
+    """
+    if info.modes is not None:
+        return moded_arguments(info, literal)
+    return literal.tag()
+
+
+def variant_clauses(called, clauses, literal):
+    """
+    Produces the clauses that answer the literal from the clauses that
+    answered the called literal, which is a variant of it, by replacing the
+    variables of the call with those at the same positions in the literal.
+    """
+    if called is literal:
+        return list(clauses)
+    env = {c: t for c, t in zip(called.terms, literal.terms) if not c.is_const()}
+    return [clause.subst(env) for clause in clauses]
+
+
+def call_predicate(info, context, calls):
+    """
+    Calls the predicate for each of the (key, literal) pairs. Produces a list
+    with the rows, or the clauses for predicates without binding modes, of
+    each call. Calls of async predicates are run concurrently.
+    """
+    kwargs = {'context': context} if info.needs_context else {}
+    if info.batch:
+        answers = info.function([key for key, literal in calls], **kwargs)
+        if info.is_async:
+            answers = run_async(answers)
+        if len(answers) != len(calls):
+            raise ExtensionError("Predicate '{}' produced {} answers for {} bindings".format(info.predicate, len(answers), len(calls)))
+        return [list(answer) for answer in answers]
+
+    if info.modes is not None:
+        results = [info.function(*key, **kwargs) for key, literal in calls]
+    else:
+        results = [info.function(literal.pred, *literal.terms, **kwargs) for key, literal in calls]
+    if info.is_async:
+        return run_async(gather(results))
+    return [list(result) for result in results]
+
+
+def answer_function(info, cache=None):
+    """
+    Creates a function that produces a list of clauses for each of many
+    literals. Each distinct call is made once, and not at all if its answer
+    is cached.
+    """
+    def predicate_answers(literals, context):
+        keys = [call_key(info, literal) for literal in literals]
+        answers = {}
+        missing = {}
+        for key, literal in zip(keys, literals):
+            if key in answers or key in missing:
+                continue
+            cached = cache.get(key) if cache is not None else None
+            if cached is None:
+                missing[key] = literal
+            else:
+                answers[key] = cached
+        if missing:
+            for (key, called), answer in zip(missing.items(), call_predicate(info, context, list(missing.items()))):
+                if info.modes is None:
+                    # clauses mention the variables of the call they answer
+                    answer = (called, answer)
+                answers[key] = answer
+                if cache is not None:
+                    cache.put(key, answer)
+
+        if info.modes is None:
+            return [variant_clauses(*answers[key], literal) for literal, key in zip(literals, keys)]
+        return [list(moded_clauses(info, literal, answers[key])) for literal, key in zip(literals, keys)]
+    return predicate_answers
+
+
+def predicate_batch(info, cache=None):
+    """
+    Creates the batch interface of a predicate, which produces a list of
+    clauses for each of many literals with a single call. Returns None if the
+    predicate is neither called in batches nor async.
+    """
+    if not info.batch and not info.is_async:
+        return None
+    return functools.wraps(info.function)(answer_function(info, cache))
+
+
+def predicate_generator(info, cache=None):
+    if info.modes is not None or info.is_async or cache is not None:
+        answers = answer_function(info, cache)
+
+        @functools.wraps(info.function)
+        def predicate_proxy(literal, context):
+            yield from answers([literal], context)[0]
+    elif info.needs_context:
         @functools.wraps(info.function)
         def predicate_proxy(literal, context):
             context_info = {
@@ -15,19 +15,33 @@ A contrived example is:
     True
 """
 
+import threading
 import weakref
 
 
+# Guards the creation of instances, so that concurrent threads can not both
+# create an instance for the same key. Reentrant, as creating an instance may
+# create others.
+_creation = threading.RLock()
+
+
+def _reintern(cls, args, kwargs):
+    """Recreates an interned instance, used when unpickling."""
+    return cls(*args, **kwargs)
+
+
 class Interned:
     """Mixin to apply correct equality and hashing for interned instances."""
-    def __eq__(self, other):
-        return self is other
-
-    def __ne__(self, other):
-        return self is not other
+    # interned instances compare by identity, which is exactly what the
+    # builtin implementations do without a python level call
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
 
-    def __hash__(self):
-        return id(self)
+    def __reduce__(self):
+        # unpickling goes through the class lookup again, so that pickled
+        # instances sent between processes are interned on arrival
+        return (_reintern, (type(self),) + self._interned_args)
 
 
 class InternalizeMeta(type):
@@ -62,6 +76,11 @@ class InternalizeMeta(type):
         key = cls._key(args, kwargs)
         result = cls._lookup.get(key)
         if not result:
-            result = type.__call__(cls, *args, **kwargs)
-            cls._lookup[key] = result
+            with _creation:
+                # another thread may have created it in the meantime
+                result = cls._lookup.get(key)
+                if not result:
+                    result = type.__call__(cls, *args, **kwargs)
+                    result._interned_args = (args, kwargs)
+                    cls._lookup[key] = result
         return result
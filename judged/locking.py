@@ -0,0 +1,98 @@
+"""
+This module provides the readers-writer lock that allows a knowledge base to
+be shared between threads. Any number of queries can read the knowledge base at
+the same time, while changes to it are made by one writer at a time, with no
+queries running.
+"""
+
+import contextlib
+import threading
+
+
+class ReadWriteLock:
+    """
+    A lock that is held by any number of readers at once, or by a single
+    writer.
+
+    Writers are preferred: once a writer waits, new readers wait until it is
+    done, so that a steady stream of queries can not hold off changes forever.
+    Both sides are reentrant. A thread that reads may read again, even while a
+    writer waits, and the writer may write and read again. A thread that reads
+    may also start to write, once it is the only reader left.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting = 0
+
+    def _reads(self):
+        return getattr(self._local, 'reads', 0)
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            # reads by the writer need no bookkeeping
+            self._local.nested = getattr(self._local, 'nested', 0) + 1
+            return
+        with self._condition:
+            if not self._reads():
+                while self._writer is not None or self._waiting:
+                    self._condition.wait()
+            self._readers += 1
+        self._local.reads = self._reads() + 1
+
+    def release_read(self):
+        if getattr(self._local, 'nested', 0):
+            self._local.nested -= 1
+            return
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+        self._local.reads -= 1
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+                return
+            # the reads of this thread can not be given up, so it only waits
+            # for the other readers
+            reads = self._reads()
+            self._waiting += 1
+            try:
+                while self._writer is not None or self._readers > reads:
+                    self._condition.wait()
+            finally:
+                self._waiting -= 1
+            self._writer = me
+            self._depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._depth -= 1
+            if not self._depth:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def reading(self):
+        """Holds the lock as a reader for the duration of the with block."""
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def writing(self):
+        """Holds the lock as the writer for the duration of the with block."""
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -5,6 +5,7 @@ clauses as well as a Knowledge base implementation and a Prover.
 
 from judged import *
 from judged import worlds
+from judged.locking import ReadWriteLock
 import judged.primitives
 
 
@@ -14,12 +15,31 @@ class Knowledge:
 
     The knowledge base keeps track of the asserted clauses and the primitive
     predicates. It starts out with only the built-in equals predicate.
+
+    A knowledge base can be shared by the provers of several threads. Changes
+    to it are made while holding its lock as a writer, and queries hold it as
+    a reader.
     """
-    def __init__(self, context):
+    def __init__(self, context, indexing=True):
         self.context = context
+        self.indexing = indexing
         self.facts = dict()
         self.rules = dict()
         self.prim = dict()
+        # predicates with a primitive that answers many literals in one call
+        self.batched = set()
+        # reverse predicate dependency graph: for each predicate, counts the
+        # rules of other predicates that use it in their body
+        self.dependents = dict()
+        # callables that are told about each change with the predicate, the
+        # changed clause, a list of facts added at once, or None for a
+        # primitive, and whether it was added or removed
+        self.listeners = list()
+        # for each partitioning, counts the clauses that mention each of its
+        # parts, and caches the exclusion bdd of the partitioning
+        self.partitions = dict()
+        self.exclusions = dict()
+        self.lock = ReadWriteLock()
 
         judged.primitives.register_primitives(self)
 
@@ -53,42 +73,129 @@ class Knowledge:
 
     def assert_clause(self, clause):
         """Asserts a clause. Raises an error if the clause is unsafe."""
-        self.raise_for_safety(clause)
-
-        # select database first
-        db = self.facts if not clause.body else self.rules
-
-        # assert fact
-        pred = clause.head.pred
-        bucket = db.setdefault(pred, dict())
-        bucket[clause.id] = clause
-        return clause
+        with self.lock.writing():
+            self.raise_for_safety(clause)
+
+            # select database first
+            db = self.facts if not clause.body else self.rules
+
+            # assert fact
+            pred = clause.head.pred
+            bucket = db.get(pred)
+            if bucket is None:
+                bucket = db[pred] = ClauseBucket(pred.arity)
+            if clause.id in bucket:
+                return clause
+            for lit in clause.body:
+                counts = self.dependents.setdefault(lit.pred, dict())
+                counts[pred] = counts.get(pred, 0) + 1
+            bucket.add(clause)
+            for partitioning, part in clause.sentence.labels():
+                counts = self.partitions.setdefault(partitioning, dict())
+                if part not in counts:
+                    self.exclusions.pop(partitioning, None)
+                counts[part] = counts.get(part, 0) + 1
+            self.changed(pred, clause, True)
+            return clause
+
+    def assert_facts(self, clauses):
+        """
+        Asserts many clauses at once. Ground facts without a descriptive
+        sentence are always safe and touch no dependencies or partitionings,
+        so they are added to their buckets directly, and the listeners are told
+        once about each predicate that changed, with the list of facts added to
+        it. Other clauses are asserted one by one.
+        """
+        with self.lock.writing():
+            changed = dict()
+            for clause in clauses:
+                if clause.body or clause.sentence != worlds.Top() or not clause.head.is_grounded():
+                    self.assert_clause(clause)
+                    continue
+
+                pred = clause.head.pred
+                bucket = self.facts.get(pred)
+                if bucket is None:
+                    bucket = self.facts[pred] = ClauseBucket(pred.arity)
+                if clause.id not in bucket:
+                    bucket.add(clause)
+                    changed.setdefault(pred, []).append(clause)
+            for pred, added in changed.items():
+                self.changed(pred, added, True)
 
     def retract_clause(self, clause):
         """Retracts a clause."""
-        pred = clause.head.pred
-        # select database first
-        db = self.facts if not clause.body else self.rules
-
-        # select bucket
-        bucket = db.get(pred, None)
-        if bucket:
-            bucket.pop(clause.id, None)
-
-        # if we emptied the bucket, remove it
-        if not bucket:
-            db.pop(pred, None)
-        return clause
+        with self.lock.writing():
+            pred = clause.head.pred
+            # select database first
+            db = self.facts if not clause.body else self.rules
+
+            # select bucket
+            bucket = db.get(pred, None)
+            removed = None
+            if bucket:
+                removed = bucket.discard(clause)
+
+            # if we emptied the bucket, remove it
+            if not bucket:
+                db.pop(pred, None)
+
+            if removed is not None:
+                for lit in removed.body:
+                    counts = self.dependents[lit.pred]
+                    counts[pred] -= 1
+                    if not counts[pred]:
+                        del counts[pred]
+                for partitioning, part in removed.sentence.labels():
+                    counts = self.partitions[partitioning]
+                    counts[part] -= 1
+                    if not counts[part]:
+                        del counts[part]
+                        self.exclusions.pop(partitioning, None)
+                        if not counts:
+                            del self.partitions[partitioning]
+                self.changed(pred, removed, False)
+            return clause
 
     class PrimitiveInfo:
-        def __init__(self, generator, description):
+        def __init__(self, generator, description, batch=None):
             self.generator = generator
             self.description = description
+            self.batch = batch
 
-    def add_primitive(self, predicate, generator, description):
-        """Creates a primitive predicate by coupling it to a generator."""
-        self.prim.setdefault(predicate, [])
-        self.prim[predicate].append(Knowledge.PrimitiveInfo(generator, description))
+    def add_primitive(self, predicate, generator, description, batch=None):
+        """
+        Creates a primitive predicate by coupling it to a generator. The
+        optional batch function takes a list of literals and produces the
+        list of clauses for each of them with a single call.
+        """
+        with self.lock.writing():
+            self.prim.setdefault(predicate, [])
+            self.prim[predicate].append(Knowledge.PrimitiveInfo(generator, description, batch))
+            if batch is not None:
+                self.batched.add(predicate)
+            self.changed(predicate, None, True)
+
+    def changed(self, predicate, clause, added):
+        """Informs all listeners of a change to the clauses of the predicate."""
+        for listener in self.listeners:
+            listener(predicate, clause, added)
+
+    def affected(self, predicates):
+        """
+        Determines the predicates whose answers might change if the clauses of
+        the given predicates change, i.e., the given predicates and all
+        predicates that depend on them.
+        """
+        result = set(predicates)
+        todo = list(result)
+        while todo:
+            pred = todo.pop()
+            for dependent in self.dependents.get(pred, ()):
+                if dependent not in result:
+                    result.add(dependent)
+                    todo.append(dependent)
+        return result
 
     def clauses(self, literal):
         """
@@ -105,35 +212,182 @@ class Knowledge:
             for primitive in self.prim[pred]:
                 yield from primitive.generator(literal, self.context)
 
-        # produce asserted clauses
+        # produce asserted clauses, narrowed down by the bucket indexes if the
+        # literal has bound arguments
         for db in (self.facts, self.rules):
             if pred in db:
-                yield from db[pred].values()
+                if self.indexing:
+                    yield from db[pred].matching(literal)
+                else:
+                    yield from db[pred].values()
+
+    def clauses_many(self, literals):
+        """
+        Determines the clauses for each of the literals, which must all have
+        the same predicate, as a list per literal. Primitives with a batch
+        function are called once for all literals instead of once for each.
+        """
+        pred = literals[0].pred
+        results = [[] for literal in literals]
+
+        for primitive in self.prim.get(pred, ()):
+            if primitive.batch is not None:
+                for result, clauses in zip(results, primitive.batch(literals, self.context)):
+                    result.extend(clauses)
+            else:
+                for result, literal in zip(results, literals):
+                    result.extend(primitive.generator(literal, self.context))
+
+        for db in (self.facts, self.rules):
+            bucket = db.get(pred)
+            if bucket:
+                for result, literal in zip(results, literals):
+                    result.extend(bucket.matching(literal) if self.indexing else bucket.values())
+        return results
 
     def parts(self, partitioning):
-        # NOTE: Used exclusively for worlds.exclusion_matrix and uniform distribution
-        result = set()
-        for db in (self.rules, self.facts):
-            for bucket in db.values():
-                for clause in bucket.values():
-                    labels = list(lbl[1] for lbl in clause.sentence.labels() if lbl[0]==partitioning)
-                    result.update(labels)
+        """Determines the parts of the partitioning used by any clause."""
+        return set(self.partitions.get(partitioning, ()))
+
+    def exclusion(self, partitioning):
+        """
+        Determines the exclusion bdd of the partitioning, which is cached until
+        the parts of the partitioning change.
+        """
+        try:
+            return self.exclusions[partitioning]
+        except KeyError:
+            result = self.exclusions[partitioning] = worlds.exclusion(partitioning, self.parts(partitioning))
+            return result
+
+
+class ClauseBucket(dict):
+    """
+    A bucket holds all clauses of a single predicate, keyed by clause id.
+
+    The bucket maintains a hash index for each argument position of the head
+    literal, mapping each constant to the clauses that have that constant in
+    that position. Clauses with a variable in a position are kept under the
+    `None` key for that position, as they match any constant. Indexes on
+    combinations of positions are built on first use and maintained from then
+    on.
+    """
+    def __init__(self, arity):
+        super().__init__()
+        self.positions = [dict() for i in range(arity)]
+        self.combinations = dict()
+
+    @staticmethod
+    def _key(term):
+        return term if term.is_const() else None
+
+    def _combination_key(self, clause, combination):
+        key = tuple(self._key(clause.head[i]) for i in combination)
+        return key if None not in key else None
+
+    def add(self, clause):
+        """Adds a clause to the bucket and all of its indexes."""
+        id = clause.id
+        if id in self:
+            self.discard(clause)
+        self[id] = clause
+        for i, term in enumerate(clause.head):
+            self.positions[i].setdefault(self._key(term), dict())[id] = clause
+        for combination, index in self.combinations.items():
+            index.setdefault(self._combination_key(clause, combination), dict())[id] = clause
+
+    def discard(self, clause):
+        """
+        Removes a clause from the bucket and all of its indexes. Returns the
+        removed clause, or None if the clause was not present.
+        """
+        clause = self.pop(clause.id, None)
+        if clause is None:
+            return None
+        for i, term in enumerate(clause.head):
+            self._discard_from(self.positions[i], self._key(term), clause)
+        for combination, index in self.combinations.items():
+            self._discard_from(index, self._combination_key(clause, combination), clause)
+        return clause
+
+    @staticmethod
+    def _discard_from(index, key, clause):
+        entries = index.get(key)
+        if entries is not None:
+            entries.pop(clause.id, None)
+            if not entries:
+                del index[key]
+
+    def _combination(self, combination):
+        index = self.combinations.get(combination)
+        if index is None:
+            index = dict()
+            for clause in self.values():
+                index.setdefault(self._combination_key(clause, combination), dict())[clause.id] = clause
+            self.combinations[combination] = index
+        return index
+
+    def matching(self, literal):
+        """
+        Produces the clauses that might unify with the given literal based on
+        the constants bound in it. Clauses that do not match the bound
+        constants are never produced; the produced clauses still need to be
+        unified.
+        """
+        bound = tuple(i for i, term in enumerate(literal) if term.is_const())
+        if not bound:
+            return self.values()
+
+        if len(bound) == 1:
+            index = self.positions[bound[0]]
+            key = literal[bound[0]]
+        else:
+            index = self._combination(bound)
+            key = tuple(literal[i] for i in bound)
+
+        exact = index.get(key, {})
+        wildcard = index.get(None, {})
+        if not wildcard:
+            return exact.values()
+
+        # with a combination index, clauses in the wildcard group might still
+        # have a mismatching constant on one of the positions
+        result = list(exact.values())
+        for clause in wildcard.values():
+            if all(not clause.head[i].is_const() or clause.head[i] is literal[i] for i in bound):
+                result.append(clause)
         return result
 
 
 class Subgoal:
+    __slots__ = ('literal', 'anss', 'poss', 'negs', 'comp', 'frame', 'heads', 'unconditional')
+
     def __init__(self, literal):
         self.literal = literal
         self.anss = set()
         self.poss = list()
         self.negs = list()
         self.comp = False
+        # the subgoal's frame on the stack while it is not completed
+        self.frame = None
+        # answers grouped by head, and the heads with an unconditional answer
+        self.heads = dict()
+        self.unconditional = set()
+
+    def add_answer(self, clause):
+        """Adds an answer clause to the subgoal."""
+        self.anss.add(clause)
+        self.heads.setdefault(clause.head, []).append(clause)
+        if not clause.body and not clause.delayed:
+            self.unconditional.add(clause.head)
 
     def __repr__(self):
         return "Subgoal(literal={}, anss={}, poss={}, negs={}, comp={})".format(self.literal, self.anss, self.poss, self.negs, self.comp)
 
 
 class Waiter:
+    __slots__ = ('literal', 'clause', 'selected')
+
     def __init__(self, literal, clause, selected):
         self.literal = literal
         self.clause = clause
@@ -144,14 +398,20 @@ class Waiter:
 
 
 class Frame:
-    def __init__(self, subgoal, dfn, poslink, neglink):
+    __slots__ = ('subgoal', 'dfn', 'poslink', 'neglink', 'index')
+
+    def __init__(self, subgoal, dfn, poslink, neglink, index):
         self.subgoal = subgoal
         self.dfn = dfn
         self.poslink = poslink
         self.neglink = neglink
+        # position of the frame on the stack
+        self.index = index
 
 
 class Mins:
+    __slots__ = ('posmin', 'negmin')
+
     def __init__(self, posmin, negmin):
         self.posmin = posmin
         self.negmin = negmin
@@ -171,36 +431,88 @@ class Prover:
 
     A prover is not thread-safe. Multi-threaded use requires the construction
     of multiple provers.
+
+    If reuse_tables is set, completed subgoals are kept between queries. They
+    are discarded when the clauses of a predicate they depend on change, when
+    a different checker is used, or when invalidate is called. Subgoals that
+    depend on primitive predicates provided by extensions are discarded after
+    every query. Reuse of tables is only correct if the checker gives the same
+    verdicts across queries.
     """
-    def __init__(self, knowledge, debugger=None):
+    def __init__(self, knowledge, debugger=None, reuse_tables=False):
         self.kb = knowledge
         self.debugger = debugger
+        self.reuse_tables = reuse_tables
         # initialize bookkeeping
         self.subgoals = dict()
         self.stack = list()
         self.count = 1
         self.checker = None
+        self.changes = set()
+        # clauses of primitive subgoals that were looked up ahead of time
+        self.prefetched = dict()
+        if reuse_tables:
+            knowledge.listeners.append(self.knowledge_changed)
+
+    def knowledge_changed(self, predicate, clause, added):
+        """Records the predicate as changed to discard the affected tables."""
+        self.changes.add(predicate)
+
+    def invalidate(self):
+        """Discards all tables."""
+        self.subgoals.clear()
+        self.changes.clear()
 
-    def ask(self, query, checker):
+    def prepare_tables(self, checker):
         """
-        Sets up and activates the subgoal search machinery. The answer is then
-        returned as a list of proven facts. [Chen et al., Figure 13, p. 181]
+        Discards the tables that can not be reused for a query with the given
+        checker.
+        """
+        if not self.reuse_tables or checker != self.checker:
+            self.invalidate()
+            return
+
+        volatile = {p for p in self.kb.prim if p != judged.primitives.EQUALS_PREDICATE}
+        affected = self.kb.affected(self.changes | volatile)
+        self.changes.clear()
+        for tag, subgoal in list(self.subgoals.items()):
+            if not subgoal.comp or subgoal.literal.pred in affected:
+                del self.subgoals[tag]
+
+    def solve(self, query, checker):
+        """
+        Sets up and activates the subgoal search machinery. Returns the
+        completed subgoal for the query. [Chen et al., Figure 13, p. 181]
         """
         self.count = 1
-        self.subgoals.clear()
         self.stack.clear()
+        self.prefetched.clear()
+        self.prepare_tables(checker)
         self.checker = checker
 
-        subgoal = Subgoal(query)
-        self.subgoals[query.tag()] = subgoal
+        if self.debugger: self.debugger.ask(query)
 
-        dfn = self.count
-        self.stack.append(Frame(subgoal, dfn, dfn, float('inf')))
-        self.count += 1
+        subgoal = self.subgoals.get(query.tag())
+        if subgoal is not None:
+            if self.debugger: self.debugger.note("reusing table for '{}'".format(subgoal.literal))
+        else:
+            subgoal = Subgoal(query)
+            self.subgoals[query.tag()] = subgoal
+
+            dfn = self.count
+            self.push_frame(subgoal, dfn, dfn, float('inf'))
+            self.count += 1
+
+            self.run(self.slg_subgoal(query, Mins(dfn, float('inf'))))
 
-        if self.debugger: self.debugger.ask(query)
-        self.slg_subgoal(query, Mins(dfn, float('inf')))
         if self.debugger: self.debugger.done(subgoal)
+        return subgoal
+
+    def ask(self, query, checker):
+        """
+        Answers the query. The answer is returned as a list of proven facts.
+        """
+        subgoal = self.solve(query, checker)
 
         seen = set()
         for answer in subgoal.anss:
@@ -215,6 +527,30 @@ class Prover:
         """
         return worlds.evaluate(sentence, self.checker)
 
+    def run(self, task):
+        """
+        Runs an SLG task to completion.
+
+        The slg_* methods are written as tasks: generators that yield each
+        task they call, and resume when the called task has completed. The
+        tasks are kept on an explicit agenda instead of the interpreter's
+        stack, so deep derivations are limited by memory rather than by the
+        recursion limit. The order in which work is done is exactly that of
+        the recursive formulation.
+        """
+        agenda = [task]
+        while agenda:
+            try:
+                agenda.append(next(agenda[-1]))
+            except StopIteration:
+                agenda.pop()
+
+    def push_frame(self, subgoal, dfn, poslink, neglink):
+        """Pushes a new frame for the subgoal on the stack."""
+        frame = Frame(subgoal, dfn, poslink, neglink, len(self.stack))
+        subgoal.frame = frame
+        self.stack.append(frame)
+
     def slg_resolve(self, clause, selected, other):
         """
         Determines the SLG resolvent of a clause G with selected literal Li and
@@ -256,13 +592,58 @@ class Prover:
         [Chen et al., Figure 14, p. 182]
         """
         if self.debugger: self.debugger.subgoal(literal)
-        for clause in self.kb.clauses(literal):
+        clauses = self.prefetched.pop(literal.tag(), None)
+        if clauses is None:
+            clauses = self.kb.clauses(literal)
+        if self.kb.batched:
+            clauses = list(clauses)
+            self.prefetch(self.lookahead(literal, clauses))
+        for clause in clauses:
             if not self.allows(clause.sentence):
                 continue
             resolvent = self.slg_resolve(Clause(literal, [literal]), literal, clause)
             if resolvent is not None:
-                self.slg_newclause(literal, resolvent, mins)
-        self.slg_complete(literal, mins)
+                yield self.slg_newclause(literal, resolvent, mins)
+        yield self.slg_complete(literal, mins)
+
+    def lookahead(self, literal, clauses):
+        """
+        Determines the clauses that resolving the clauses of the literal will
+        lead to: the resolvents that still have a body, and the resolvents of
+        the waiters on the literal with the resolvents that are answers.
+        """
+        subgoal = self.subgoals[literal.tag()]
+        result = []
+        for clause in clauses:
+            resolvent = self.slg_resolve(Clause(literal, [literal]), literal, clause)
+            if resolvent is None:
+                continue
+            if resolvent.body or resolvent.delayed:
+                result.append(resolvent)
+            else:
+                for waiter in subgoal.poss:
+                    result.append(self.slg_resolve(waiter.clause, waiter.selected, resolvent))
+        return result
+
+    def prefetch(self, clauses):
+        """
+        Looks up the clauses of the primitive subgoals that the clauses will
+        select, with a single call per predicate to primitives that answer many
+        literals at once. Only the lookups are done early, the order of the
+        resolution steps stays the same.
+        """
+        pending = {}
+        for clause in clauses:
+            selected = self.select(clause) if clause is not None else None
+            if selected is None or not selected.polarity or selected.pred not in self.kb.batched:
+                continue
+            tag = selected.tag()
+            if tag not in self.subgoals and tag not in self.prefetched:
+                pending.setdefault(selected.pred, {}).setdefault(tag, selected)
+        for literals in pending.values():
+            literals = list(literals.values())
+            for literal, found in zip(literals, self.kb.clauses_many(literals)):
+                self.prefetched[literal.tag()] = found
 
     def select(self, clause):
         """
@@ -290,17 +671,17 @@ class Prover:
         selected = self.select(clause)
         if selected is None:
             if self.debugger: self.debugger.answer(literal, clause, selected)
-            self.slg_answer(literal, clause, mins)
+            yield self.slg_answer(literal, clause, mins)
         elif selected.polarity == True:
             if self.debugger: self.debugger.clause(literal, clause, selected, True)
-            self.slg_positive(literal, clause, selected, mins)
+            yield self.slg_positive(literal, clause, selected, mins)
         elif selected.polarity == False and selected.is_grounded():
             if self.debugger: self.debugger.clause(literal, clause, selected, False)
-            self.slg_negative(literal, clause, selected.invert(), mins)
+            yield self.slg_negative(literal, clause, selected.invert(), mins)
         else:
             raise JudgedError('Selected a non-grounded negative literal.')
 
-    def answer_subsumed_by(self, clause, answers):
+    def answer_subsumed_by(self, clause, subgoal):
         # Due to the safety constraints the clause's head will feature no
         # variables if the body is empty. slg_answer, and thus
         # answer_subsumed_by, is only called after no literal can be selected
@@ -308,17 +689,13 @@ class Prover:
         # so call subsumption is not possible.
         #
         # However, subsumption through equality is still possible. So, we check
-        # all answers to see if the same head was already found (ignoring the
-        # sentence of the clause).
-        for cl in answers:
-            if cl.head == clause.head:
-                return True
-        return False
+        # if the same head was already found (ignoring the sentence of the
+        # clause).
+        return clause.head in subgoal.heads
 
-    def other_answer_with_same_head(self, clause, answers):
-        for a in answers:
-            if clause == a: continue
-            if clause.head == a.head:
+    def other_answer_with_same_head(self, clause, subgoal):
+        for a in subgoal.heads.get(clause.head, ()):
+            if clause != a:
                 return True
         return False
 
@@ -327,22 +704,22 @@ class Prover:
         [Chen et al., Figure 15, p. 183]
         """
         subgoal = self.subgoals[literal.tag()]
-        if self.answer_subsumed_by(clause, subgoal.anss):
+        if self.answer_subsumed_by(clause, subgoal):
             return
-        subgoal.anss.add(clause)
+        subgoal.add_answer(clause)
         if not clause.delayed:
             subgoal.negs.clear()
             for waiter in subgoal.poss:
                 resolvent = self.slg_resolve(waiter.clause, waiter.selected, clause)
                 if resolvent is not None:
-                    self.slg_newclause(waiter.literal, resolvent, mins)
+                    yield self.slg_newclause(waiter.literal, resolvent, mins)
         else:
-            if self.other_answer_with_same_head(clause, subgoal.anss):
+            if self.other_answer_with_same_head(clause, subgoal):
                 return
             for waiter in subgoal.poss:
                 factor = self.slg_factor(waiter.clause, waiter.selected, clause)
                 if factor is not None:
-                    self.slg_newclause(waiter.literal, factor, mins)
+                    yield self.slg_newclause(waiter.literal, factor, mins)
 
     def slg_positive(self, literal, clause, selected, mins):
         """
@@ -355,10 +732,10 @@ class Prover:
             dfn = self.count
             poslink = self.count
             neglink = float('inf')
-            self.stack.append(Frame(subgoal, dfn, poslink, neglink))
+            self.push_frame(subgoal, dfn, poslink, neglink)
             self.count += 1
             bmins = Mins(dfn, float('inf'))
-            self.slg_subgoal(selected, bmins)
+            yield self.slg_subgoal(selected, bmins)
             self.update_solution(literal, selected, True, mins, bmins)
         else:
             subgoal = self.subgoals[selected.tag()]
@@ -366,18 +743,15 @@ class Prover:
                 subgoal.poss.append(Waiter(literal, clause, selected))
                 self.update_lookup(literal, selected, True, mins)
             todo = []
-            def fact_in_collection(fact, collection):
-                for cl in collection:
-                    if cl.head == fact:
-                        return True
-                return False
             for c in subgoal.anss:
-                if fact_in_collection(c.head, subgoal.anss):
+                if c.head in subgoal.heads:
                     todo.append(self.slg_resolve(clause, selected, Clause(c.head,[],[])))
                 else:
                     todo.append(self.slg_factor(clause, selected, c))
+            if self.kb.batched:
+                self.prefetch(todo)
             for c in todo:
-                self.slg_newclause(literal, c, mins)
+                yield self.slg_newclause(literal, c, mins)
 
     def clause_remove_lit(self, clause, lit):
         """
@@ -412,41 +786,31 @@ class Prover:
             dfn = self.count
             poslink = dfn
             neglink = float('inf')
-            self.stack.append(Frame(subgoal, dfn, poslink, neglink))
+            self.push_frame(subgoal, dfn, poslink, neglink)
             self.count += 1
             bmins = Mins(dfn, float('inf'))
-            self.slg_subgoal(selected, mins)
+            yield self.slg_subgoal(selected, mins)
             self.update_solution(literal, selected, False, mins, bmins)
         else:
             subgoal = self.subgoals[selected.tag()]
             if not subgoal.comp:
-                if Clause(selected, [], []) not in subgoal.anss:
+                if selected not in subgoal.unconditional:
                     subgoal.negs.append(Waiter(literal, clause, selected))
                     self.update_lookup(literal, selected, False, mins)
             else:
                 negselected = selected.invert()
                 if not subgoal.anss:
-                    self.slg_newclause(literal, self.clause_remove_lit(clause, negselected), mins)
-                elif Clause(selected, [], []) not in subgoal.anss:
-                    self.slg_newclause(literal, self.clause_delay_lit(clause, negselected), mins)
+                    yield self.slg_newclause(literal, self.clause_remove_lit(clause, negselected), mins)
+                elif selected not in subgoal.unconditional:
+                    yield self.slg_newclause(literal, self.clause_delay_lit(clause, negselected), mins)
 
     def update_lookup(self, literal, selected, sign, mins):
         """
         [Chen et al., Figure 18, P. 186]
         """
-        sga = self.subgoals[literal.tag()]
-        fa = None
-        for f in self.stack: # stack frame lookup ~_~
-            if f.subgoal is sga:
-                fa = f
-                break
+        fa = self.subgoals[literal.tag()].frame
         assert fa is not None
-        sgb = self.subgoals[selected.tag()]
-        fb = None
-        for f in self.stack: # stack frame lookup ~_~
-            if f.subgoal is sgb:
-                fb = f
-                break
+        fb = self.subgoals[selected.tag()].frame
         assert fb is not None
 
         if sign:
@@ -462,12 +826,7 @@ class Prover:
         """
         [Chen et al., Figure 18, p. 186]
         """
-        sga = self.subgoals[literal.tag()]
-        fa = None
-        for f in self.stack: # stack frame lookup ~_~
-            if f.subgoal is sga:
-                fa = f
-                break
+        fa = self.subgoals[literal.tag()].frame
         assert fa is not None
         sgb = self.subgoals[selected.tag()]
 
@@ -480,12 +839,7 @@ class Prover:
             mins.negmin = min(mins.negmin, bmins.negmin)
 
     def slg_complete(self, literal, mins):
-        sga = self.subgoals[literal.tag()]
-        fa = None
-        for f in self.stack: # stack frame lookup ~_~
-            if f.subgoal is sga:
-                fa = f
-                break
+        fa = self.subgoals[literal.tag()].frame
         assert fa is not None
 
         fa.poslink = min(fa.poslink, mins.posmin)
@@ -502,6 +856,7 @@ class Prover:
             for fb in popped:
                 negs = fb.subgoal.negs
                 fb.subgoal.comp = True
+                fb.subgoal.frame = None
                 fb.subgoal.poss.clear()
                 fb.subgoal.negs.clear()
                 if self.debugger: self.debugger.complete(fb.subgoal)
@@ -509,14 +864,14 @@ class Prover:
                 for waiter in negs:
                     if not fb.subgoal.anss:
                         todo.append((waiter.literal, self.clause_remove_lit(waiter.clause, negselected)))
-                    elif Clause(selected, [], []) not in subgoal.anss:
+                    elif fb.subgoal.literal not in fb.subgoal.unconditional:
                         todo.append((waiter.literal, self.clause_delay_lit(waiter.clause, negselected)))
                 mins.posmin = float('inf')
                 mins.negmin = float('inf')
                 for literal, clause in todo:
-                    self.slg_newclause(literal, clause, mins)
+                    yield self.slg_newclause(literal, clause, mins)
         elif fa.poslink == fa.dfn and fa.neglink >= fa.dfn:
-            frames = self.stack[self.stack.index(fa):]
+            frames = self.stack[fa.index:]
             frames.reverse()
             todo = []
             for fb in frames:
@@ -528,42 +883,34 @@ class Prover:
             mins.posmin = self.stack[-1:][0].dfn
             mins.negmin = float('inf')
             for literal, clause in todo:
-                self.slg_newclause(literal, clause, mins)
+                yield self.slg_newclause(literal, clause, mins)
             for fb in frames:
-                self.slg_complete(fb.subgoal.literal, mins)
+                yield self.slg_complete(fb.subgoal.literal, mins)
 
 
 class ExactProver(Prover):
     """Prover for symbolic sentence handling. Subclasses the normal prover and
     only replaces those methods that are modified with respect to the normal
     operations."""
-    def ask(self, query, checker):
+    def knowledge_changed(self, predicate, clause, added):
         """
-        Sets up and activates the subgoal search machinery. The answer is then
-        returned as a list of proven facts. [Chen et al., Figure 13, p. 181]
+        A clause with labels can change the mutual exclusions used to compare
+        the sentences of any answer, which makes all tables invalid.
         """
-        self.count = 1
-        self.subgoals.clear()
-        self.stack.clear()
-        self.checker = checker
-
-        subgoal = Subgoal(query)
-        self.subgoals[query.tag()] = subgoal
-
-        dfn = self.count
-        self.stack.append(Frame(subgoal, dfn, dfn, float('inf')))
-        self.count += 1
+        if isinstance(clause, Clause) and clause.sentence.labels():
+            self.invalidate()
+        else:
+            super().knowledge_changed(predicate, clause, added)
 
-        if self.debugger: self.debugger.ask(query)
-        self.slg_subgoal(query, Mins(dfn, float('inf')))
-        if self.debugger: self.debugger.done(subgoal)
+    def ask(self, query, checker):
+        """
+        Answers the query. The answer is returned as a list of proven facts
+        with the disjunction of all sentences under which the fact holds.
+        """
+        subgoal = self.solve(query, checker)
 
-        seen = dict()
-        for answer in subgoal.anss:
-            seen.setdefault(answer.head, [])
-            seen[answer.head].append(answer.sentence)
-        for head, sentences in seen.items():
-            yield Clause(head, [], [], worlds.disjunct(*sentences))
+        for head, answers in subgoal.heads.items():
+            yield Clause(head, [], [], worlds.disjunct(*[a.sentence for a in answers]))
 
     def slg_resolve(self, clause, selected, other):
         """
@@ -613,29 +960,32 @@ class ExactProver(Prover):
         selected = self.select(clause)
         if selected is None:
             if self.debugger: self.debugger.answer(literal, clause, selected)
-            self.slg_answer(literal, clause, mins)
+            yield self.slg_answer(literal, clause, mins)
         elif selected.polarity == True:
             if self.debugger: self.debugger.clause(literal, clause, selected, True)
-            self.slg_positive(literal, clause, selected, mins)
+            yield self.slg_positive(literal, clause, selected, mins)
         elif selected.polarity == False and selected.is_grounded():
             if self.debugger: self.debugger.clause(literal, clause, selected, False)
             raise JudgedError('Discovered a negative literal during reasoning: exact prover can not handle negation.')
         else:
             raise JudgedError('Selected a non-grounded negative literal.')
 
-    def answer_subsumed_by(self, clause, answers):
+    def answer_subsumed_by(self, clause, subgoal):
         # Due to the safety constraints the clause's head will feature no
         # variables if the body is empty. slg_answer, and thus
         # answer_subsumed_by, is only called after no literal can be selected
         # so the body must be empty. Judged does not support compound terms,
         # so call subsumption is not possible.
         #
-        # However, subsumption through equality is still possible.
+        # However, subsumption through equality is still possible. Only the
+        # answers with the same head need their sentences compared.
+        answers = subgoal.heads.get(clause.head, ())
         result = False
         for cl in answers:
             # XXX: cl.body and cl.delayed empty? This might be an issue.
-            if cl.head == clause.head and worlds.equivalent(cl.sentence, clause.sentence, self.kb):
-                result =  True
+            if worlds.equivalent(cl.sentence, clause.sentence, self.kb):
+                result = True
+                break
         if self.debugger: self.debugger.note("answer_subsumed_by({}, {}) -> {}".format(clause, '{' + ', '.join("{}".format(a) for a in answers) + '}', result))
         return result
 
@@ -650,10 +1000,10 @@ class ExactProver(Prover):
             dfn = self.count
             poslink = self.count
             neglink = float('inf')
-            self.stack.append(Frame(subgoal, dfn, poslink, neglink))
+            self.push_frame(subgoal, dfn, poslink, neglink)
             self.count += 1
             bmins = Mins(dfn, float('inf'))
-            self.slg_subgoal(selected, bmins)
+            yield self.slg_subgoal(selected, bmins)
             self.update_solution(literal, selected, True, mins, bmins)
         else:
             subgoal = self.subgoals[selected.tag()]
@@ -661,13 +1011,8 @@ class ExactProver(Prover):
                 subgoal.poss.append(Waiter(literal, clause, selected))
                 self.update_lookup(literal, selected, True, mins)
             todo = []
-            def fact_in_collection(fact, collection):
-                for cl in collection:
-                    if cl.head == fact and not cl.body and not cl.delayed:
-                        return True
-                return False
             for c in subgoal.anss:
-                if fact_in_collection(c.head, subgoal.anss):
+                if c.head in subgoal.unconditional:
                     # try to unify with already present answers, this should only
                     # fail if it leads to a contradictory world
                     resolvent = self.slg_resolve(clause, selected, Clause(c.head,[],[],c.sentence))
@@ -678,5 +1023,7 @@ class ExactProver(Prover):
                     assert resolvent is not None
                     todo.append(resolvent)
                     #todo.append(self.slg_factor(clause, selected, c))
+            if self.kb.batched:
+                self.prefetch(todo)
             for c in todo:
-                self.slg_newclause(literal, c, mins)
+                yield self.slg_newclause(literal, c, mins)
@@ -6,7 +6,6 @@ unlimited pushback buffer.
 """
 
 import functools
-import io
 
 import judged
 from judged import tokenizer
@@ -120,12 +119,11 @@ def rule(parse_func):
         if type(source) == Tokens:
             return parse_func(source)
 
-        # transform strings into a readable thing
-        if isinstance(source, str):
-            source = io.StringIO(source)
-        # transform any readable thing into a token stream
+        # transform any readable thing into text, and text into a token stream
         if hasattr(source, 'read'):
-            source = tokenizer.tokenize(source)
+            source = source.read()
+        if isinstance(source, str):
+            source = tokenizer.tokenize_text(source)
         # wrap anything that's not already a Tokens in a Tokens
         if not isinstance(source, Tokens):
             source = Tokens(source)
@@ -146,6 +144,152 @@ def parse(tokens):
     return actions.CompoundAction(children)
 
 
+def parse_bulk(source):
+    """
+    Parser entry point for bulk loading that produces a stream of actions.
+    Consecutive ground facts are collected into a single action that asserts
+    all of them at once. Up to the first other action, facts are matched
+    directly in the text without tokenizing it. Everything after that is
+    tokenized, and ground facts are picked out of the tokens.
+    """
+    if hasattr(source, 'read'):
+        source = source.read()
+
+    facts = []
+    spellings = {}
+    constants = {}
+    predicates = {}
+    pos = 0
+    line = start = 1
+    while True:
+        m = tokenizer.fact.match(source, pos)
+        clause = m and make_ground_fact(m, spellings, predicates)
+        if clause is None:
+            break
+        line += m.group('skip').count('\n')
+        if not facts:
+            start = line
+        facts.append(clause)
+        line += m.group().count('\n', len(m.group('skip')))
+        pos = m.end()
+
+    children = []
+    if facts:
+        children.append(actions.AssertFactsAction(facts, source=LocationContext(start, line)))
+    children.extend(parse_bulk_tokens(tokenizer.tokenize_text(source[pos:], line), constants, predicates))
+    return actions.CompoundAction(children)
+
+
+def make_ground_fact(match, constants, predicates):
+    """
+    Constructs the clause for a fact matched in the text, or returns None if
+    the fact has variables. The given dictionaries are used to intern
+    constants by spelling and predicates.
+    """
+    terms = []
+    if match.group('terms'):
+        for spelling in tokenizer.fact_term.findall(match.group('terms')):
+            constant = constants.get(spelling)
+            if constant is None:
+                if spelling[0] == '"':
+                    constant = judged.Constant.string(tokenizer.unescape(spelling[1:-1]))
+                elif tokenizer.number_spelling.fullmatch(spelling):
+                    constant = judged.Constant.number(tokenizer.number(spelling))
+                elif spelling[:1].isupper() or spelling == '_':
+                    return None
+                else:
+                    constant = judged.Constant.symbol(spelling)
+                constants[spelling] = constant
+            terms.append(constant)
+
+    key = (match.group('predicate'), len(terms))
+    predicate = predicates.get(key)
+    if predicate is None:
+        predicate = predicates[key] = judged.Predicate(*key)
+    return judged.Clause(judged.Literal(predicate, terms))
+
+
+def parse_bulk_tokens(tokens, constants, predicates):
+    """
+    Produces the actions parsed from the token stream, with consecutive ground
+    facts collected into a single action.
+    """
+    tokens = Tokens(tokens)
+    facts = []
+    start_t = end_t = None
+    while tokens:
+        fact = parse_ground_fact(tokens, constants, predicates)
+        if fact is not None:
+            clause, first_t, end_t = fact
+            if not facts:
+                start_t = first_t
+            facts.append(clause)
+            continue
+
+        if facts:
+            yield actions.AssertFactsAction(facts, source=LocationContext(start_t[2], end_t[2]))
+            facts = []
+        yield parse_action(tokens)
+
+    if facts:
+        yield actions.AssertFactsAction(facts, source=LocationContext(start_t[2], end_t[2]))
+
+
+def parse_ground_fact(tokens, constants, predicates):
+    """
+    Tries to read a ground fact without a descriptive sentence, i.e., a
+    predicate with only constants as terms that is closed by a period. Returns
+    the clause with its first and last token, or None if the next action is
+    not such a fact. In that case, all tokens are left in the stream.
+
+    The given dictionaries are used to intern constants and predicates.
+    """
+    read = []
+
+    def take(test):
+        t = tokens._next()
+        if t is not None:
+            read.append(t)
+        return t is not None and test(t)
+
+    def give_up():
+        for t in reversed(read):
+            tokens.push(t)
+        return None
+
+    if not take(lambda t: t[0] == NAME):
+        return give_up()
+
+    terms = []
+    if take(lambda t: t[0] == LPAREN):
+        while True:
+            if not take(IDENTIFIER):
+                return give_up()
+            kind, spelling, location = read[-1]
+            if kind == NAME and (spelling[:1].isupper() or spelling == '_'):
+                return give_up()
+            key = (kind, spelling)
+            constant = constants.get(key)
+            if constant is None:
+                constant = constants[key] = make_term(read[-1])
+            terms.append(constant)
+            if not take(lambda t: t[0] in (COMMA, RPAREN)):
+                return give_up()
+            if read[-1][0] == RPAREN:
+                break
+        if not take(lambda t: t[0] == PERIOD):
+            return give_up()
+    elif read[-1][0] != PERIOD:
+        return give_up()
+
+    key = (read[0][1], len(terms))
+    predicate = predicates.get(key)
+    if predicate is None:
+        predicate = predicates[key] = judged.Predicate(*key)
+    clause = judged.Clause(judged.Literal(predicate, terms))
+    return clause, read[0], read[-1]
+
+
 @rule
 def parse_action(tokens):
     """
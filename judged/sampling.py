@@ -0,0 +1,325 @@
+"""
+Sampling of worlds for the Monte Carlo variant.
+
+Single parts are drawn from alias tables, which take constant time for each
+draw regardless of the number of parts in the partitioning.
+
+The sampling schemes determine how the worlds of the runs are drawn. Plain
+sampling draws each part from the distribution of its partitioning. Stratified
+sampling fixes the parts of the partitionings with the highest entropy for
+each stratum, and divides the runs over the strata. Importance sampling draws
+the parts that the answers need more often, and weighs each run to correct for
+this.
+
+For batched sampling the worlds of a batch are drawn at once as a matrix with a row for each world
+and a column for each partitioning, holding the index of the chosen part. The
+sentences describing the answers are compiled to boolean array expressions
+over these columns, so that each sentence is evaluated for the whole batch in
+a single pass.
+
+Batched sampling requires NumPy, which is an optional dependency of judged. If
+it is not installed, `available` is False.
+"""
+
+import collections
+import itertools
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from judged import JudgedError
+from judged import worlds
+
+
+available = numpy is not None
+
+
+class AliasTable:
+    """
+    Alias table for drawing from a discrete distribution in constant time,
+    following Walker's alias method as constructed by Vose. The distribution is
+    given as a mapping of outcomes to probabilities, which must sum to 1.
+
+    Each outcome gets a column; a draw picks a column uniformly, and then
+    either accepts the column's outcome or takes its alias.
+    """
+    def __init__(self, probabilities):
+        self.outcomes = list(probabilities)
+        n = len(self.outcomes)
+        scaled = [p * n for p in probabilities.values()]
+        self.accept = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            # the column of s is filled up with outcome l
+            self.accept[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # any remaining columns are full, up to rounding errors
+
+    def draw(self, source):
+        """Draws an outcome using the given random source."""
+        u = source.random() * len(self.outcomes)
+        i = min(int(u), len(self.outcomes) - 1)
+        if u - i < self.accept[i]:
+            return self.outcomes[i]
+        else:
+            return self.outcomes[self.alias[i]]
+
+
+class Tally:
+    """
+    The counts of a number of simulation runs. The runs are counted per
+    stratum, and each run has a weight. For each stratum, the answers are
+    counted by the sum of the weights and the sum of the squared weights of
+    the runs in which they hold. The worlds are counted by the sum of the
+    weights of the runs in which they were drawn.
+    """
+    def __init__(self):
+        self.runs = collections.Counter()
+        self.answers = {}
+        self.squares = {}
+        self.worlds = collections.Counter()
+
+    def add(self, stratum, weight, answers, world):
+        """Adds a single run."""
+        self.runs[stratum] += 1
+        sums = self.answers.setdefault(stratum, collections.Counter())
+        squares = self.squares.setdefault(stratum, collections.Counter())
+        for a in answers:
+            sums[a] += weight
+            squares[a] += weight * weight
+        self.worlds[world] += weight
+
+
+class PlainSampling:
+    """
+    Draws each part from the distribution of its partitioning. There is a
+    single stratum, the empty one, holding all worlds.
+    """
+    def __init__(self, context, lineage):
+        self.strata = {(): 1.0}
+
+    def allocate(self, done, iterations):
+        """
+        Determines the stratum of each of the next runs, given the runs done so
+        far for each stratum. The counts of done runs are updated.
+        """
+        done[()] += iterations
+        return itertools.repeat((), iterations)
+
+    def pick(self, context, partitioning):
+        """Picks a part of the partitioning for the context's current run."""
+        return context.table(partitioning).draw(context.random)
+
+
+def _partitionings(lineage):
+    return {lbl[0] for clause, sentence in lineage for lbl in sentence.labels()}
+
+
+def _needed(sentence, polarity=True):
+    """Determines the labels that must hold for the sentence to hold."""
+    if isinstance(sentence, worlds.Label):
+        return {(sentence.partitioning, sentence.part)} if polarity else set()
+    elif isinstance(sentence, worlds.Negation):
+        return _needed(sentence.sub, not polarity)
+    elif isinstance(sentence, (worlds.Conjunction, worlds.Disjunction)):
+        return {lbl for t in sentence.terms for lbl in _needed(t, polarity)}
+    else:
+        return set()
+
+
+class StratifiedSampling(PlainSampling):
+    """
+    Stratifies the worlds by the parts of the partitionings with the highest
+    entropy, taking as many partitionings as fit within the limit on the
+    number of strata. The parts of these partitionings are fixed for each
+    run, the other parts are drawn as usual.
+
+    Every stratum is given a run first, after which the runs are divided in
+    proportion to the probabilities of the strata.
+    """
+    # The maximum number of strata
+    limit = 64
+
+    def __init__(self, context, lineage):
+        def entropy(partitioning):
+            # looking up the table validates the distribution
+            context.table(partitioning)
+            return -sum(p * math.log(p) for p in context.prob[partitioning].values() if p > 0)
+
+        chosen = []
+        size = 1
+        for partitioning in sorted(_partitionings(lineage), key=lambda p: (-entropy(p), p.tag())):
+            parts = [(partitioning, v) for v, p in context.prob[partitioning].items() if p > 0]
+            if len(parts) > 1 and size * len(parts) <= self.limit:
+                chosen.append(parts)
+                size *= len(parts)
+
+        self.strata = {}
+        for stratum in itertools.product(*chosen):
+            probability = 1.0
+            for p, v in stratum:
+                probability *= context.prob[p][v]
+            self.strata[stratum] = probability
+
+    def allocate(self, done, iterations):
+        for i in range(iterations):
+            total = sum(done.values()) + 1
+            # strata without runs go first, then the stratum that is furthest
+            # behind its share
+            stratum = min(self.strata, key=lambda s: (done[s] > 0, done[s] - self.strata[s] * total))
+            done[stratum] += 1
+            yield stratum
+
+
+class ImportanceSampling(PlainSampling):
+    """
+    Biases the draws towards the parts that the answers need to hold, i.e.,
+    the labels that occur in the lineage without being negated. For each
+    partitioning with needed parts, a share of the draws is spread evenly over
+    these parts, and the remainder follows the assigned distribution. Each run
+    is weighted by the ratio of the assigned to the biased probability of the
+    drawn parts.
+    """
+    # The share of the draws spread over the needed parts
+    bias = 0.5
+
+    def __init__(self, context, lineage):
+        super().__init__(context, lineage)
+        needed = {}
+        for clause, sentence in lineage:
+            for p, v in _needed(sentence):
+                needed.setdefault(p, set()).add(v)
+
+        self.tables = {}
+        self.ratios = {}
+        for partitioning in _partitionings(lineage):
+            # looking up the table validates the distribution
+            context.table(partitioning)
+            probs = context.prob[partitioning]
+            parts = [v for v in probs if v in needed.get(partitioning, ())]
+            if not parts:
+                continue
+            biased = {v: (1 - self.bias) * p for v, p in probs.items()}
+            for v in parts:
+                biased[v] += self.bias / len(parts)
+            self.tables[partitioning] = AliasTable(biased)
+            self.ratios[partitioning] = {v: probs[v] / biased[v] for v in probs if biased[v] > 0}
+
+    def pick(self, context, partitioning):
+        table = self.tables.get(partitioning)
+        if table is None:
+            return super().pick(context, partitioning)
+        part = table.draw(context.random)
+        context.weight *= self.ratios[partitioning][part]
+        return part
+
+
+def generator(source):
+    """Creates a NumPy random generator seeded from the given random source."""
+    return numpy.random.default_rng(source.getrandbits(64))
+
+
+class BatchSampler:
+    """
+    Samples worlds in batches and determines in which of them each answer
+    holds. The lineage is given as a list of answers, each with the sentence
+    describing the worlds in which it holds. The probabilities are given as a
+    mapping of partitionings to mappings of parts to probabilities.
+    """
+    def __init__(self, lineage, prob):
+        used = {lbl[0] for clause, sentence in lineage for lbl in sentence.labels()}
+        # columns are ordered by tag to draw the same worlds from the same seed
+        self.partitionings = sorted(used, key=lambda p: p.tag())
+        self.parts = []
+        self.cumulative = []
+        for partitioning in self.partitionings:
+            try:
+                probs = prob[partitioning]
+            except KeyError:
+                raise JudgedError("Probabilities for partitioning '{}' not set".format(partitioning))
+            if any(p < 0 for p in probs.values()) or abs(sum(probs.values()) - 1.0) > 1e-6:
+                raise JudgedError("Probabilities for partitioning '{}' do not sum to 1.0.".format(partitioning))
+            self.parts.append(list(probs))
+            cumulative = numpy.cumsum(list(probs.values()))
+            # rounding can leave the last sum just below 1.0, which a drawn
+            # number could exceed
+            cumulative[-1] = 1.0
+            self.cumulative.append(cumulative)
+        self.columns = {p: i for i, p in enumerate(self.partitionings)}
+        self.answers = [(clause, self.compile(sentence)) for clause, sentence in lineage]
+
+    def compile(self, sentence):
+        """
+        Compiles a sentence to a function that determines for a batch of worlds
+        in which of them the sentence holds.
+        """
+        if isinstance(sentence, worlds.Label):
+            column = self.columns[sentence.partitioning]
+            try:
+                index = self.parts[column].index(sentence.part)
+            except ValueError:
+                # a part without probability is never chosen
+                return lambda samples: numpy.zeros(len(samples), dtype=bool)
+            return lambda samples: samples[:, column] == index
+        elif isinstance(sentence, worlds.Top):
+            return lambda samples: numpy.ones(len(samples), dtype=bool)
+        elif isinstance(sentence, worlds.Bottom):
+            return lambda samples: numpy.zeros(len(samples), dtype=bool)
+        elif isinstance(sentence, worlds.Negation):
+            sub = self.compile(sentence.sub)
+            return lambda samples: ~sub(samples)
+        elif isinstance(sentence, (worlds.Conjunction, worlds.Disjunction)):
+            terms = [self.compile(t) for t in sentence.terms]
+            combine = numpy.logical_and if isinstance(sentence, worlds.Conjunction) else numpy.logical_or
+            def evaluate(samples):
+                result = terms[0](samples)
+                for term in terms[1:]:
+                    combine(result, term(samples), out=result)
+                return result
+            return evaluate
+        else:
+            raise JudgedError("Can not compile sentence '{}' for batched sampling.".format(sentence))
+
+    def draw(self, rng, size):
+        """Draws a batch of worlds."""
+        samples = numpy.empty((size, len(self.partitionings)), dtype=numpy.intp)
+        uniform = rng.random(samples.shape)
+        for column, cumulative in enumerate(self.cumulative):
+            # the first part whose cumulative probability exceeds the drawn
+            # number is chosen, so parts without probability never are
+            samples[:, column] = numpy.searchsorted(cumulative, uniform[:, column], side='right')
+        return samples
+
+    def sample(self, rng, size, tally):
+        """Samples a batch of worlds, and adds the runs to the tally."""
+        samples = self.draw(rng, size)
+
+        tally.runs[()] += size
+        answers = tally.answers.setdefault((), collections.Counter())
+        squares = tally.squares.setdefault((), collections.Counter())
+        for clause, evaluate in self.answers:
+            count = int(numpy.count_nonzero(evaluate(samples)))
+            if count:
+                answers[clause] += count
+                squares[clause] += count
+
+        if self.partitionings:
+            rows, counts = numpy.unique(samples, axis=0, return_counts=True)
+            for row, count in zip(rows.tolist(), counts.tolist()):
+                world = frozenset((self.partitionings[c], self.parts[c][i]) for c, i in enumerate(row))
+                tally.worlds[world] += count
+        else:
+            tally.worlds[frozenset()] += size
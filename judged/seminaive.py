@@ -0,0 +1,729 @@
+"""
+Bottom-up evaluation of judged programs.
+
+The semi-naive prover materializes the relations of all derived predicates
+that a query depends on with a stratified semi-naive fixpoint computation.
+Materialized relations are retained across queries, and can be maintained
+incrementally when facts are asserted or retracted, which makes this prover
+well suited to workloads that pose many queries over a mostly static knowledge
+base.
+"""
+
+from judged import JudgedError, Literal, Clause, make_fresh_var
+from judged import worlds
+from judged.logic import Subgoal
+from judged.primitives import EQUALS_PREDICATE
+
+
+class Relation:
+    """
+    A set of ground rows, i.e., tuples of constants, with hash indexes on
+    combinations of positions. Indexes are built on first use and maintained
+    from then on.
+    """
+    def __init__(self):
+        self.rows = set()
+        self.indexes = dict()
+
+    @classmethod
+    def of(cls, rows):
+        """Creates a relation with the given rows."""
+        result = cls()
+        for row in rows:
+            result.add(row)
+        return result
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, row):
+        return row in self.rows
+
+    def add(self, row):
+        """Adds a row to the relation. Returns True if the row is new."""
+        if row in self.rows:
+            return False
+        self.rows.add(row)
+        for positions, index in self.indexes.items():
+            index.setdefault(tuple(row[i] for i in positions), set()).add(row)
+        return True
+
+    def discard(self, row):
+        """Removes a row from the relation, if it is present."""
+        if row not in self.rows:
+            return
+        self.rows.discard(row)
+        for positions, index in self.indexes.items():
+            key = tuple(row[i] for i in positions)
+            entries = index[key]
+            entries.discard(row)
+            if not entries:
+                del index[key]
+
+    def lookup(self, positions, key):
+        """Produces all rows that have the values in key on the positions."""
+        if not positions:
+            return self.rows
+        index = self.indexes.get(positions)
+        if index is None:
+            index = dict()
+            for row in self.rows:
+                index.setdefault(tuple(row[i] for i in positions), set()).add(row)
+            self.indexes[positions] = index
+        return index.get(key, ())
+
+
+class Overlay:
+    """
+    A view on a relation with some rows added and others removed. Overlays
+    are used to look at the state of a relation before a change.
+    """
+    def __init__(self, base, added, removed):
+        self.base = base
+        self.added = added
+        self.removed = removed
+
+    def __contains__(self, row):
+        return row in self.added or (row not in self.removed and row in self.base)
+
+    def lookup(self, positions, key):
+        for row in self.base.lookup(positions, key):
+            if row not in self.removed:
+                yield row
+        for row in self.added:
+            if all(row[i] is k for i, k in zip(positions, key)):
+                yield row
+
+
+class Facts:
+    """
+    Presents the asserted facts of a predicate as a relation. Only facts that
+    are allowed by the prover's checker are part of the relation.
+    """
+    def __init__(self, prover, pred):
+        self.prover = prover
+        self.pred = pred
+
+    def __contains__(self, row):
+        return any(True for r in self.lookup(range(len(row)), row))
+
+    def lookup(self, positions, key):
+        bucket = self.prover.kb.facts.get(self.pred)
+        if not bucket:
+            return
+        terms = [make_fresh_var() for i in range(self.pred.arity)]
+        for i, k in zip(positions, key):
+            terms[i] = k
+        for clause in bucket.matching(Literal(self.pred, terms)):
+            row = tuple(clause.head)
+            if all(row[i] is k for i, k in zip(positions, key)) and self.prover.allows(clause.sentence):
+                yield row
+
+
+class Stratum:
+    """
+    A strongly connected component in the predicate dependency graph,
+    together with the rules defining its predicates.
+    """
+    def __init__(self, predicates):
+        self.predicates = predicates
+        self.rules = []
+        self.dependencies = set()
+        self.volatile = False
+
+
+def _variables(literal):
+    return {t for t in literal if not t.is_const()}
+
+
+def _match(terms, row, env):
+    """
+    Extends the environment such that the terms match the row. Returns None if
+    no such extension exists.
+    """
+    result = env
+    copied = False
+    for term, value in zip(terms, row):
+        if term.is_const():
+            if term is not value:
+                return None
+        else:
+            bound = result.get(term)
+            if bound is None:
+                if not copied:
+                    result = dict(result)
+                    copied = True
+                result[term] = value
+            elif bound is not value:
+                return None
+    return result
+
+
+class SeminaiveProver:
+    """
+    A bottom-up prover that answers queries from materialized relations. The
+    prover offers the same ask interface as the SLG based Prover, but only
+    handles programs with stratified negation.
+
+    Relations are materialized with semi-naive evaluation: after the first
+    round, every round only joins with the rows derived in the previous round.
+    Relations that depend on primitive predicates provided by extensions are
+    considered volatile, and are recomputed for every query.
+
+    Asserting or retracting facts discards the materialized relations that
+    depend on them, unless they are maintained. The relations of maintained
+    predicates, and of all predicates they depend on, are updated
+    incrementally with the delete and rederive algorithm [Gupta et al., 1993].
+    Changes to rules always discard all relations.
+
+    A prover is not thread-safe. Multi-threaded use requires the construction
+    of multiple provers.
+    """
+    def __init__(self, knowledge, debugger=None):
+        self.kb = knowledge
+        self.debugger = debugger
+        self.checker = None
+        self.strata = None
+        self.order = []
+        self.relations = dict()
+        self.maintained = set()
+        self.changes = []
+        knowledge.listeners.append(self.knowledge_changed)
+
+    def maintain(self, predicate):
+        """
+        Maintains the materialized relation of the predicate incrementally,
+        instead of discarding it when the facts it depends on change.
+        """
+        self.maintained.add(predicate)
+
+    def knowledge_changed(self, predicate, clause, added):
+        """Records changes to facts, and discards everything if rules change."""
+        if isinstance(clause, list):
+            # facts asserted in bulk
+            self.changes.extend((predicate, c, added) for c in clause)
+        elif clause is None or clause.body:
+            self.strata = None
+        else:
+            self.changes.append((predicate, clause, added))
+
+    def invalidate(self):
+        """Discards all materialized relations and the stratification."""
+        self.strata = None
+
+    def ask(self, query, checker):
+        """
+        Materializes all relations the query depends on, and produces the
+        matching rows from them as a list of proven facts.
+        """
+        if self.strata is None or self.checker != checker:
+            self.checker = checker
+            self.relations.clear()
+            self.changes.clear()
+            self.stratify()
+        else:
+            if self.changes:
+                self.update()
+            for stratum in self.order:
+                if stratum.volatile:
+                    self.discard(stratum)
+
+        if self.debugger: self.debugger.ask(query)
+        subgoal = Subgoal(query)
+        stratum = self.strata.get(query.pred)
+        if stratum is not None:
+            self.materialize(stratum)
+        for env in self.lookup(query, dict()):
+            subgoal.add_answer(Clause(query.subst(env), [], []))
+        if self.debugger: self.debugger.done(subgoal)
+
+        yield from subgoal.anss
+
+    def allows(self, sentence):
+        """
+        Checks if the sentence is allowed in the set of worlds currently
+        chosen.
+        """
+        return worlds.evaluate(sentence, self.checker)
+
+    def stratify(self):
+        """
+        Determines the strata of the program by computing the strongly
+        connected components of the predicate dependency graph. Raises an error
+        if a predicate depends negatively on itself.
+        """
+        graph = dict()
+        for pred, bucket in self.kb.rules.items():
+            graph[pred] = {lit.pred for rule in bucket.values() for lit in rule.body}
+
+        # iterative version of Tarjan's algorithm, which produces the
+        # components in dependency order
+        index = dict()
+        lowlink = dict()
+        stack = []
+        onstack = set()
+        components = []
+        counter = 0
+        for root in graph:
+            if root in index:
+                continue
+            work = [(root, iter(graph[root]))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            onstack.add(root)
+            while work:
+                node, successors = work[-1]
+                for succ in successors:
+                    if succ not in graph:
+                        continue
+                    if succ not in index:
+                        index[succ] = lowlink[succ] = counter
+                        counter += 1
+                        stack.append(succ)
+                        onstack.add(succ)
+                        work.append((succ, iter(graph[succ])))
+                        break
+                    elif succ in onstack:
+                        lowlink[node] = min(lowlink[node], index[succ])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = set()
+                        while True:
+                            member = stack.pop()
+                            onstack.discard(member)
+                            component.add(member)
+                            if member is node:
+                                break
+                        components.append(component)
+
+        strata = dict()
+        order = []
+        for component in components:
+            stratum = Stratum(component)
+            order.append(stratum)
+            for pred in component:
+                strata[pred] = stratum
+                stratum.rules.extend(self.kb.rules[pred].values())
+                if pred in self.kb.prim:
+                    stratum.volatile = True
+
+            for rule in stratum.rules:
+                for lit in rule.body:
+                    if lit.pred in component:
+                        if not lit.polarity:
+                            raise JudgedError("Program is not stratified, '{}' depends negatively on itself through '{}'.".format(rule.head.pred, lit.pred))
+                    elif lit.pred in strata:
+                        stratum.dependencies.add(strata[lit.pred])
+                        stratum.volatile |= strata[lit.pred].volatile
+                    elif lit.pred in self.kb.prim and lit.pred != EQUALS_PREDICATE:
+                        stratum.volatile = True
+
+        self.strata = strata
+        self.order = order
+
+    def is_materialized(self, stratum):
+        """Determines whether the relations of the stratum are materialized."""
+        return next(iter(stratum.predicates)) in self.relations
+
+    def discard(self, stratum):
+        """Discards the materialized relations of the stratum."""
+        for pred in stratum.predicates:
+            self.relations.pop(pred, None)
+
+    def materialize(self, stratum):
+        """
+        Materializes the relations of the stratum and all strata it depends
+        on. Strata are processed in dependency order.
+        """
+        if self.is_materialized(stratum):
+            return
+
+        order = []
+        seen = set()
+        work = [(stratum, iter(stratum.dependencies))]
+        seen.add(stratum)
+        while work:
+            current, dependencies = work[-1]
+            for dependency in dependencies:
+                if dependency in seen:
+                    continue
+                seen.add(dependency)
+                if self.is_materialized(dependency):
+                    continue
+                work.append((dependency, iter(dependency.dependencies)))
+                break
+            else:
+                work.pop()
+                order.append(current)
+
+        for current in order:
+            self.evaluate(current)
+
+    def evaluate(self, stratum):
+        """
+        Computes the fixpoint of a single stratum with semi-naive evaluation.
+        """
+        if self.debugger: self.debugger.note("evaluating stratum {{{}}}".format(', '.join(str(p) for p in stratum.predicates)))
+
+        full = {pred: Relation() for pred in stratum.predicates}
+        delta = {pred: Relation() for pred in stratum.predicates}
+
+        # seed with the facts
+        for pred in stratum.predicates:
+            for fact in self.kb.facts.get(pred, {}).values():
+                if self.allows(fact.sentence):
+                    row = tuple(fact.head)
+                    full[pred].add(row)
+                    delta[pred].add(row)
+
+        # exit rules only need to be evaluated once
+        for rule in self.rules(stratum):
+            if not any(lit.pred in stratum.predicates for lit in rule.body):
+                for row in self.join(rule, self.plan(rule.body)):
+                    if full[rule.head.pred].add(row):
+                        delta[rule.head.pred].add(row)
+
+        # publish the relations so lookups within the stratum find them
+        self.relations.update(full)
+        self.fixpoint(stratum, delta)
+
+    def rules(self, stratum):
+        """Produces the rules of the stratum that are allowed."""
+        for rule in stratum.rules:
+            if self.allows(rule.sentence):
+                yield rule
+
+    def fixpoint(self, stratum, delta):
+        """
+        Performs semi-naive rounds for the recursive rules of the stratum,
+        starting from the rows in delta, until no new rows are derived. Returns
+        the newly derived rows for each predicate.
+        """
+        result = {pred: set() for pred in stratum.predicates}
+        plans = dict()
+        while any(delta.values()):
+            derived = {pred: Relation() for pred in stratum.predicates}
+            for rule in self.rules(stratum):
+                for position, lit in enumerate(rule.body):
+                    if lit.pred not in stratum.predicates or not delta[lit.pred]:
+                        continue
+                    key = (rule, position)
+                    plan = plans.get(key)
+                    if plan is None:
+                        plan = plans[key] = self.plan(rule.body, position)
+                    for row in self.join(rule, plan, {position: delta}):
+                        if row not in self.relations[rule.head.pred]:
+                            derived[rule.head.pred].add(row)
+            for pred, relation in derived.items():
+                for row in relation:
+                    self.relations[pred].add(row)
+                result[pred].update(relation)
+            delta = derived
+        return result
+
+    def net_changes(self):
+        """
+        Determines the rows that were added to and removed from the asserted
+        facts of each predicate since the last query. Returns two dicts that
+        map predicates to the sets of added and removed rows.
+        """
+        # the first change of a clause tells whether it was present before
+        before = dict()
+        for pred, clause, added in self.changes:
+            before.setdefault(clause.id, (pred, clause, not added))
+        self.changes.clear()
+
+        touched = dict()
+        for pred, clause, present in before.values():
+            touched.setdefault((pred, tuple(clause.head)), []).append((clause, present))
+
+        inserted = dict()
+        deleted = dict()
+        for (pred, row), clauses in touched.items():
+            ids = {clause.id for clause, present in clauses}
+            bucket = self.kb.facts.get(pred, {})
+            current = [c for c in bucket.matching(Literal(pred, list(row))) if tuple(c.head) == row] if bucket else []
+            after = any(self.allows(c.sentence) for c in current)
+            untouched = any(self.allows(c.sentence) for c in current if c.id not in ids)
+            was = untouched or any(present and self.allows(clause.sentence) for clause, present in clauses)
+            if after and not was:
+                inserted.setdefault(pred, set()).add(row)
+            elif was and not after:
+                deleted.setdefault(pred, set()).add(row)
+        return inserted, deleted
+
+    def update(self):
+        """
+        Brings the materialized relations up to date with the changes to the
+        asserted facts. Maintained strata are updated incrementally, all other
+        affected strata are discarded.
+        """
+        inserted, deleted = self.net_changes()
+
+        maintained = set()
+        todo = [self.strata[p] for p in self.maintained if p in self.strata]
+        while todo:
+            stratum = todo.pop()
+            if stratum not in maintained:
+                maintained.add(stratum)
+                todo.extend(stratum.dependencies)
+
+        for stratum in self.order:
+            if not self.is_materialized(stratum):
+                continue
+            changed = set(inserted) | set(deleted)
+            dependencies = {lit.pred for rule in stratum.rules for lit in rule.body}
+            if not changed & (dependencies | stratum.predicates):
+                continue
+            if stratum in maintained and not stratum.volatile:
+                if self.debugger: self.debugger.note("maintaining stratum {{{}}}".format(', '.join(str(p) for p in stratum.predicates)))
+                self.maintain_stratum(stratum, inserted, deleted)
+            else:
+                self.discard(stratum)
+                # nothing is known about the changes to discarded relations,
+                # so every stratum depending on them must be discarded too
+                for pred in stratum.predicates:
+                    inserted.setdefault(pred, set())
+
+    def maintain_stratum(self, stratum, inserted, deleted):
+        """
+        Updates the relations of a single stratum with the delete and rederive
+        algorithm, given the rows inserted into and deleted from the relations
+        and facts it depends on. The net changes to the relations of the
+        stratum are added to inserted and deleted.
+        """
+        preds = stratum.predicates
+        relations = {pred: self.relations[pred] for pred in preds}
+        rules = list(self.rules(stratum))
+
+        # the state before the changes, as seen from this stratum
+        old = dict(self.relations)
+        for pred in set(inserted) | set(deleted):
+            if pred not in preds:
+                base = self.relations.get(pred) or Facts(self, pred)
+                old[pred] = Overlay(base, deleted.get(pred, ()), inserted.get(pred, ()))
+
+        def changed_positions(rule, changes, negated):
+            for position, lit in enumerate(rule.body):
+                if lit.pred not in preds and lit.polarity != negated and changes.get(lit.pred):
+                    yield position, lit
+
+        # 1. overestimate the deletions in the old state: everything derived
+        # from a deleted row, or blocked by an inserted row for negations
+        overdeleted = {pred: Relation() for pred in preds}
+        for pred in preds:
+            for row in deleted.get(pred, ()):
+                if row in relations[pred]:
+                    overdeleted[pred].add(row)
+        for rule in rules:
+            for changes, negated in ((deleted, False), (inserted, True)):
+                for position, lit in changed_positions(rule, changes, negated):
+                    override = {lit.pred: Relation.of(changes[lit.pred])}
+                    for row in self.join(rule, self.plan(rule.body, position), {position: override}, old):
+                        if row in relations[rule.head.pred]:
+                            overdeleted[rule.head.pred].add(row)
+
+        delta = overdeleted
+        while any(delta.values()):
+            derived = {pred: Relation() for pred in preds}
+            for rule in rules:
+                for position, lit in enumerate(rule.body):
+                    if lit.pred in preds and delta[lit.pred]:
+                        for row in self.join(rule, self.plan(rule.body, position), {position: delta}, old):
+                            if row in relations[rule.head.pred] and row not in overdeleted[rule.head.pred]:
+                                derived[rule.head.pred].add(row)
+            for pred, relation in derived.items():
+                for row in relation:
+                    overdeleted[pred].add(row)
+            delta = derived
+
+        # 2. remove the overestimate
+        for pred in preds:
+            for row in overdeleted[pred]:
+                relations[pred].discard(row)
+
+        # 3. rederive the removed rows that still have a derivation in the new
+        # state, and derive the rows made possible by the inserted rows
+        delta = {pred: Relation() for pred in preds}
+        for pred in preds:
+            for row in overdeleted[pred]:
+                if self.derivable(pred, row, rules):
+                    delta[pred].add(row)
+            for row in inserted.get(pred, ()):
+                delta[pred].add(row)
+        for rule in rules:
+            for changes, negated in ((inserted, False), (deleted, True)):
+                for position, lit in changed_positions(rule, changes, negated):
+                    override = {lit.pred: Relation.of(changes[lit.pred])}
+                    for row in self.join(rule, self.plan(rule.body, position), {position: override}):
+                        delta[rule.head.pred].add(row)
+
+        added = {pred: set() for pred in preds}
+        for pred, relation in delta.items():
+            for row in list(relation):
+                if relations[pred].add(row):
+                    added[pred].add(row)
+                else:
+                    relation.discard(row)
+
+        # 4. propagate the rederived and inserted rows
+        for pred, rows in self.fixpoint(stratum, delta).items():
+            added[pred].update(rows)
+
+        # replace the changes to the facts of the stratum's predicates with
+        # the net changes to their relations
+        for pred in preds:
+            deleted[pred] = {row for row in overdeleted[pred] if row not in relations[pred]}
+            inserted[pred] = {row for row in added[pred] if row not in overdeleted[pred]}
+
+    def derivable(self, pred, row, rules):
+        """
+        Determines whether the row can be derived for the predicate in the
+        current state, either as asserted fact or through one of the rules.
+        """
+        if row in Facts(self, pred):
+            return True
+        for rule in rules:
+            if rule.head.pred is not pred:
+                continue
+            env = _match(rule.head, row, dict())
+            if env is None:
+                continue
+            for found in self.join(rule, self.plan(rule.body, bound=set(env)), env=env):
+                return True
+        return False
+
+    def plan(self, body, first=None, bound=()):
+        """
+        Determines the order in which the body literals are joined. The
+        literal at position first, if given, is joined first. After that,
+        grounded negative literals are preferred, then positive literals of
+        derived or asserted predicates with the most bound arguments, and only
+        then primitive predicates.
+        """
+        remaining = list(range(len(body)))
+        order = []
+        bound = set(bound)
+        if first is not None:
+            remaining.remove(first)
+            order.append(first)
+            bound |= _variables(body[first])
+
+        def rank(i):
+            lit = body[i]
+            unbound = len(_variables(lit) - bound)
+            if not lit.polarity:
+                return (0 if unbound == 0 else 3, 0)
+            primitive = lit.pred in self.kb.prim and lit.pred not in self.strata
+            return (2 if primitive else 1, -(len(lit) - unbound))
+
+        while remaining:
+            best = min(remaining, key=lambda i: (rank(i), i))
+            remaining.remove(best)
+            order.append(best)
+            if body[best].polarity:
+                bound |= _variables(body[best])
+        return order
+
+    def join(self, rule, plan, overrides=None, state=None, env=None):
+        """
+        Evaluates the body of the rule set-at-a-time in the order given by the
+        plan, and produces the rows for the head. Relations are taken from the
+        state, which defaults to the current relations. The overrides map a
+        body position to the relations to use instead. A negative literal with
+        an override is joined as if it were positive.
+        """
+        overrides = overrides or dict()
+        envs = [env or dict()]
+        for position in plan:
+            lit = rule.body[position]
+            relations = overrides.get(position)
+            joined = []
+            if relations is not None:
+                positive = lit if lit.polarity else lit.invert()
+                for env in envs:
+                    joined.extend(self.lookup(positive, env, relations))
+            elif lit.polarity and lit.pred in self.kb.prim and (state or self.relations).get(lit.pred) is None:
+                # primitives are consulted for all environments at once
+                joined.extend(self.lookup_many(lit, envs))
+            elif lit.polarity:
+                for env in envs:
+                    joined.extend(self.lookup(lit, env, state))
+            else:
+                positive = lit.invert()
+                for env in envs:
+                    for found in self.lookup(positive, env, state):
+                        break
+                    else:
+                        joined.append(env)
+            envs = joined
+            if not envs:
+                return
+
+        head = rule.head
+        for env in envs:
+            row = tuple(t if t.is_const() else env.get(t, t) for t in head)
+            if not all(t.is_const() for t in row):
+                raise JudgedError("Derived a non-ground fact for '{}' during bottom-up evaluation.".format(head))
+            yield row
+
+    def lookup(self, literal, env, relations=None):
+        """
+        Produces all extensions of the environment that make the literal
+        match a known row. Materialized relations are used for derived
+        predicates, the knowledge base is consulted for everything else.
+        """
+        pred = literal.pred
+        relation = (relations or self.relations).get(pred)
+        bound = literal.subst(env)
+
+        if relation is not None:
+            positions = []
+            key = []
+            for i, term in enumerate(bound):
+                if term.is_const():
+                    positions.append(i)
+                    key.append(term)
+            for row in relation.lookup(tuple(positions), tuple(key)):
+                result = _match(bound, row, env)
+                if result is not None:
+                    yield result
+            # asserted facts are part of the relation, only the primitives
+            # still need to be consulted
+            clauses = (clause for primitive in self.kb.prim.get(pred, ()) for clause in primitive.generator(bound, self.kb.context))
+        else:
+            clauses = self.kb.clauses(bound)
+        yield from self.matches(bound, env, clauses)
+
+    def lookup_many(self, literal, envs):
+        """
+        Produces all extensions of each of the environments that make the
+        literal match a clause from the knowledge base. The knowledge base is
+        consulted once for all environments, which allows primitives to answer
+        all of them in a single batch.
+        """
+        bounds = [literal.subst(env) for env in envs]
+        for env, bound, clauses in zip(envs, bounds, self.kb.clauses_many(bounds)):
+            yield from self.matches(bound, env, clauses)
+
+    def matches(self, bound, env, clauses):
+        """
+        Produces the extensions of the environment that make the literal, to
+        which the environment is already applied, match the clauses.
+        """
+        for clause in clauses:
+            if clause.body or clause.delayed:
+                raise JudgedError("Bottom-up evaluation can not handle clause '{}' as a fact.".format(clause))
+            if not self.allows(clause.sentence):
+                continue
+            result = _match(bound, clause.head, env)
+            if result is not None:
+                yield result
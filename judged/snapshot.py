@@ -0,0 +1,407 @@
+"""
+Module responsible for saving and loading binary snapshots of a context.
+
+A snapshot holds the clauses of the knowledge base, the probabilities of the
+context and the extensions used by it, so that a knowledge base can be loaded
+without tokenizing and parsing its sources again.
+
+The snapshot consists of a header, a string table and a code of little-endian
+unsigned 32 bit integers. Every name in the snapshot is stored once in the
+string table. The code is a sequence of instructions that each start with an
+opcode. Most instructions create an object, such as a constant or a label,
+which later instructions refer to by its position among all created objects.
+This way every constant, predicate and label fragment is interned only once
+while loading. Snapshots read from a file are memory-mapped.
+"""
+
+import array
+import mmap
+import struct
+import sys
+
+import judged
+from judged import worlds
+from judged import actions
+from judged import context as contexts
+
+
+__all__ = [
+    'SnapshotError', 'save', 'load'
+]
+
+
+class SnapshotError(judged.JudgedError):
+    """
+    An error to indicate that a snapshot can not be saved or loaded.
+    """
+    pass
+
+
+MAGIC = b'JUDGEDKB'
+VERSION = 1
+
+# magic, version, number of strings, string bytes, code length
+HEADER = struct.Struct('<8sIIII')
+
+# marks an absent string
+NONE = 0xFFFFFFFF
+
+# instructions that create objects
+OP_CONSTANT = 1         # name, kind
+OP_VARIABLE = 2         # name
+OP_PREDICATE = 3        # name, arity
+OP_LABEL_STRING = 4     # constant
+OP_LABEL_NUMBER = 5     # spelling of constant
+OP_LABEL_FUNCTION = 6   # name, count, terms...
+OP_LABEL = 7            # partitioning, part
+OP_TOP = 8
+OP_BOTTOM = 9
+OP_NOT = 10             # sentence
+OP_AND = 11             # count, sentences...
+OP_OR = 12              # count, sentences...
+
+# instructions that change the context
+OP_CLAUSE = 13          # head literal, count, body literals..., count, delayed literals..., sentence
+OP_PROBABILITY = 14     # partitioning, part, spelling of probability
+OP_USE_MODULE = 15      # module, count, keys and values...
+OP_USE_PREDICATE = 16   # module, predicate, alias
+
+# a literal is written inline as: predicate, polarity, count, terms...
+
+
+def _number(spelling):
+    try:
+        return int(spelling)
+    except ValueError:
+        return float(spelling)
+
+
+class Writer:
+    """
+    Encodes the contents of a context into a string table and code.
+    """
+    def __init__(self):
+        self.strings = {}
+        self.objects = {}
+        self.code = array.array('I')
+
+    def string(self, value):
+        if value is None:
+            return NONE
+        result = self.strings.get(value)
+        if result is None:
+            result = self.strings[value] = len(self.strings)
+        return result
+
+    def emit(self, *words):
+        self.code.extend(words)
+
+    def intern(self, obj, *words):
+        """Emits the instruction that creates the object, and records it."""
+        self.code.extend(words)
+        result = self.objects[obj] = len(self.objects)
+        return result
+
+    def term(self, term):
+        result = self.objects.get(term)
+        if result is not None:
+            return result
+        if not term.is_const():
+            return self.intern(term, OP_VARIABLE, self.string(term.name))
+        if term.kind not in (None, 'string', 'number'):
+            raise SnapshotError("Can not store constant '{}' of kind '{}'.".format(term, term.kind))
+        return self.intern(term, OP_CONSTANT, self.string(term.name), self.string(term.kind))
+
+    def predicate(self, predicate):
+        result = self.objects.get(predicate)
+        if result is not None:
+            return result
+        return self.intern(predicate, OP_PREDICATE, self.string(predicate.name), predicate.arity)
+
+    def fragment(self, fragment):
+        result = self.objects.get(fragment)
+        if result is not None:
+            return result
+        if isinstance(fragment, worlds.LabelFunction):
+            terms = [self.term(t) for t in fragment.terms]
+            return self.intern(fragment, OP_LABEL_FUNCTION, self.string(fragment.name), len(terms), *terms)
+        elif isinstance(fragment.constant, str):
+            return self.intern(fragment, OP_LABEL_STRING, self.string(fragment.constant))
+        else:
+            return self.intern(fragment, OP_LABEL_NUMBER, self.string(repr(fragment.constant)))
+
+    def sentence(self, sentence):
+        result = self.objects.get(sentence)
+        if result is not None:
+            return result
+        if isinstance(sentence, worlds.Label):
+            partitioning = self.fragment(sentence.partitioning)
+            part = self.fragment(sentence.part)
+            return self.intern(sentence, OP_LABEL, partitioning, part)
+        elif isinstance(sentence, worlds.Top):
+            return self.intern(sentence, OP_TOP)
+        elif isinstance(sentence, worlds.Bottom):
+            return self.intern(sentence, OP_BOTTOM)
+        elif isinstance(sentence, worlds.Negation):
+            return self.intern(sentence, OP_NOT, self.sentence(sentence.sub))
+        else:
+            terms = [self.sentence(t) for t in sentence.terms]
+            op = OP_AND if isinstance(sentence, worlds.Conjunction) else OP_OR
+            return self.intern(sentence, op, len(terms), *terms)
+
+    def literal(self, literal):
+        # all objects used by the literal must be created before the
+        # instruction that contains it
+        predicate = self.predicate(literal.pred)
+        terms = [self.term(t) for t in literal.terms]
+        return [predicate, int(literal.polarity), len(terms)] + terms
+
+    def clause(self, clause):
+        words = self.literal(clause.head)
+        for literals in (clause.body, clause.delayed):
+            words.append(len(literals))
+            for literal in literals:
+                words.extend(self.literal(literal))
+        words.append(self.sentence(clause.sentence))
+        self.emit(OP_CLAUSE, *words)
+
+    def context(self, context):
+        for use in context.uses:
+            if isinstance(use, contexts.ModuleUse):
+                config = [self.string(w) for item in sorted(use.config.items()) for w in item]
+                self.emit(OP_USE_MODULE, self.string(use.module), len(use.config), *config)
+            else:
+                self.emit(OP_USE_PREDICATE, self.string(use.module), self.string(use.predicate), self.string(use.alias))
+
+        for db in (context.knowledge.facts, context.knowledge.rules):
+            for bucket in db.values():
+                for clause in bucket.values():
+                    self.clause(clause)
+
+        for partitioning, parts in context.prob.items():
+            for part, probability in parts.items():
+                words = [self.fragment(partitioning), self.fragment(part)]
+                self.emit(OP_PROBABILITY, *words, self.string(repr(probability)))
+
+    def write(self, target):
+        offsets = array.array('I', [0])
+        blob = bytearray()
+        for value in self.strings:
+            blob += value.encode('utf-8')
+            offsets.append(len(blob))
+        length = len(blob)
+        # keep the code aligned
+        blob += bytes(-len(blob) % 4)
+
+        code = self.code
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            code = array.array('I', code)
+            code.byteswap()
+
+        target.write(HEADER.pack(MAGIC, VERSION, len(self.strings), length, len(code)))
+        target.write(offsets.tobytes())
+        target.write(blob)
+        target.write(code.tobytes())
+
+
+class Reader:
+    """
+    Decodes a string table and code into the contents of a context.
+    """
+    def __init__(self, strings, code):
+        self.strings = strings
+        self.code = code
+        self.pos = 0
+        self.objects = []
+
+    def next(self):
+        result = self.code[self.pos]
+        self.pos += 1
+        return result
+
+    def string(self):
+        index = self.next()
+        if index == NONE:
+            return None
+        if index >= len(self.strings):
+            raise SnapshotError("The snapshot is corrupt, string {} does not exist.".format(index))
+        return self.strings[index]
+
+    def many(self, read):
+        return [read() for i in range(self.next())]
+
+    def object(self, kind=object):
+        index = self.next()
+        if index >= len(self.objects):
+            raise SnapshotError("The snapshot is corrupt, object {} does not exist.".format(index))
+        result = self.objects[index]
+        if not isinstance(result, kind):
+            raise SnapshotError("The snapshot is corrupt, object {} has the wrong type.".format(index))
+        return result
+
+    def sentence(self):
+        return self.object(worlds.Sentence)
+
+    def term(self):
+        return self.object((judged.Constant, judged.Variable))
+
+    def fragment(self):
+        return self.object(worlds.LabelFragment)
+
+    def literal(self):
+        # literals make up most of the code, so they are read in one go
+        code = self.code
+        objects = self.objects
+        pos = self.pos
+        end = pos + 3 + code[pos + 2]
+        if end > len(code):
+            raise SnapshotError("The snapshot is corrupt, a literal runs past the end.")
+        self.pos = end
+        indices = code[pos + 3:end]
+        if indices and max(indices) >= len(objects) or code[pos] >= len(objects):
+            raise SnapshotError("The snapshot is corrupt, a literal uses an object that does not exist.")
+        predicate = objects[code[pos]]
+        terms = [objects[i] for i in indices]
+        if not isinstance(predicate, judged.Predicate) or predicate.arity != len(terms) or not all(isinstance(t, (judged.Constant, judged.Variable)) for t in terms):
+            raise SnapshotError("The snapshot is corrupt, a literal does not fit its predicate.")
+        return judged.Literal(predicate, terms, bool(code[pos + 1]))
+
+    def read(self, context):
+        objects = self.objects
+        clauses = []
+        end = len(self.code)
+        while self.pos < end:
+            op = self.next()
+            if op == OP_CLAUSE:
+                head = self.literal()
+                body = self.many(self.literal)
+                delayed = self.many(self.literal)
+                clauses.append(judged.Clause(head, body, delayed, self.sentence()))
+            elif op == OP_CONSTANT:
+                name = self.string()
+                kind = self.string()
+                if kind is None:
+                    objects.append(judged.Constant.symbol(name))
+                elif kind == 'string':
+                    objects.append(judged.Constant.string(name))
+                else:
+                    objects.append(judged.Constant(name, kind='number', data=_number(name)))
+            elif op == OP_VARIABLE:
+                objects.append(judged.Variable(self.string()))
+            elif op == OP_PREDICATE:
+                name = self.string()
+                objects.append(judged.Predicate(name, self.next()))
+            elif op == OP_LABEL_STRING:
+                objects.append(worlds.LabelConstant(self.string()))
+            elif op == OP_LABEL_NUMBER:
+                objects.append(worlds.LabelConstant(_number(self.string())))
+            elif op == OP_LABEL_FUNCTION:
+                name = self.string()
+                objects.append(worlds.LabelFunction(name, tuple(self.many(self.term))))
+            elif op == OP_LABEL:
+                partitioning = self.fragment()
+                objects.append(worlds.Label(partitioning, self.fragment()))
+            elif op == OP_TOP:
+                objects.append(worlds.Top())
+            elif op == OP_BOTTOM:
+                objects.append(worlds.Bottom())
+            elif op == OP_NOT:
+                objects.append(worlds.Negation(self.sentence()))
+            elif op == OP_AND:
+                objects.append(worlds.Conjunction(*self.many(self.sentence)))
+            elif op == OP_OR:
+                objects.append(worlds.Disjunction(*self.many(self.sentence)))
+            elif op == OP_PROBABILITY:
+                partitioning = self.fragment()
+                part = self.fragment()
+                context.add_probability(partitioning, part, float(self.string()))
+            elif op == OP_USE_MODULE:
+                module = self.string()
+                config = dict(self.many(lambda: (self.string(), self.string())))
+                actions.UseModuleAction(module, config).perform(context)
+            elif op == OP_USE_PREDICATE:
+                module = self.string()
+                predicate = self.string()
+                actions.UsePredicateAction(module, predicate, self.string()).perform(context)
+            else:
+                raise SnapshotError("Unknown instruction {} in snapshot.".format(op))
+
+        context.knowledge.assert_facts(clauses)
+
+
+def save(context, target):
+    """
+    Saves a snapshot of the context to the target, which is either a file name
+    or a binary file.
+    """
+    writer = Writer()
+    writer.context(context)
+    if hasattr(target, 'write'):
+        writer.write(target)
+    else:
+        with open(target, 'wb') as f:
+            writer.write(f)
+
+
+def load(context, source):
+    """
+    Loads a snapshot from the source, which is either a file name or a binary
+    file, into the context. Snapshots in real files are memory-mapped.
+    """
+    if hasattr(source, 'read'):
+        try:
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            _load(context, source.read())
+        else:
+            with data:
+                _load(context, data)
+    else:
+        with open(source, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files can not be mapped
+                raise SnapshotError("Not a snapshot, the file is empty.")
+            with data:
+                _load(context, data)
+
+
+def _load(context, data):
+    try:
+        magic, version, count, length, size = HEADER.unpack_from(data)
+    except struct.error:
+        raise SnapshotError("Not a snapshot, the header is incomplete.")
+    if magic != MAGIC:
+        raise SnapshotError("Not a snapshot.")
+    if version != VERSION:
+        raise SnapshotError("Unsupported snapshot version {}.".format(version))
+
+    start = HEADER.size
+    blob = start + 4 * (count + 1)
+    code = blob + length + (-length % 4)
+    if len(data) < code + 4 * size:
+        raise SnapshotError("The snapshot is truncated.")
+
+    with memoryview(data) as view:
+        if sys.byteorder == 'little':
+            offsets = view[start:blob].cast('I')
+            words = view[code:code + 4 * size].cast('I')
+        else:
+            # the numbers are swapped in a copy instead
+            offsets = array.array('I', view[start:blob])
+            offsets.byteswap()
+            words = array.array('I', view[code:code + 4 * size])
+            words.byteswap()
+
+        try:
+            strings = [str(view[blob + offsets[i]:blob + offsets[i + 1]], 'utf-8') for i in range(count)]
+            Reader(strings, words).read(context)
+        except (IndexError, KeyError, UnicodeDecodeError, ValueError, TypeError):
+            # missing strings, and strings that are not numbers
+            raise SnapshotError("The snapshot is corrupt.")
+        finally:
+            if isinstance(offsets, memoryview):
+                offsets.release()
+                words.release()
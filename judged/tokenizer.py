@@ -2,9 +2,14 @@
 Tokenization module for judged sources.
 
 The tokenizer is implemented as a hard-coded state machine supported through
-several lookup tables.
+several lookup tables. For complete texts, a faster tokenizer matches whole
+tokens with a single regular expression, and falls back to the state machine
+for anything that is not a valid token so that errors are reported the same.
 """
 
+import io
+import re
+
 import judged
 from judged import TokenizeError
 from judged.tokens import *
@@ -102,9 +107,9 @@ class Characters:
     """
     Simple character stream on top of an TextIO object.
     """
-    def __init__(self, source):
+    def __init__(self, source, line=1):
         self.source = source
-        self._line = 1
+        self._line = line
         self._buffer = []
 
     @property
@@ -168,11 +173,12 @@ def number(spelling):
             raise f from e
 
 
-def tokenize(source):
+def tokenize(source, line=1):
     """
     Generator function to perform tokenization on a stream of characters.
+    Lines are numbered from the given line onwards.
     """
-    cs = Characters(source)
+    cs = Characters(source, line)
     state = S_NEUTRAL
     accum = ''
     line = 0
@@ -319,3 +325,97 @@ def tokenize(source):
             yield (NUMBER, number(accum), line)
         except ValueError as e:
             raise TokenizeError('End of file in number.', cs.line) from e
+
+
+# An escape sequence in a string literal. Like the state machine, this skips
+# any characters that do not form a valid escape after the backslash.
+string_escape = re.compile(r"""\\[^nabfrtv\\"'0-7]*(?:([nabfrtv\\"'])|([0-7]{1,3}))""")
+
+# Patterns for the tokens that carry a value. Names can not start with a digit,
+# as numbers are tried first.
+number_pattern = r'-?\d+(?:\.\d+)?'
+string_pattern = r'"(?:[^"\\\n]|\\[^nabfrtv\\"\'0-7]*(?:[nabfrtv\\"\']|[0-7]{1,3}))*"'
+name_pattern = r'[^\s(),=!:.~?\[\]@{}|%"]+'
+
+# Master pattern for the fast tokenizer, with an alternative for each kind of
+# token.
+master = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>%[^\n]*)
+  | (?P<number>{number})
+  | (?P<punct>:-|!=|[(),=.~?\[\]@{{}}|])
+  | (?P<string>{string})
+  | (?P<name>{name})
+""".format(number=number_pattern, string=string_pattern, name=name_pattern), re.VERBOSE)
+
+# Pattern for a complete fact of a predicate with only constant or variable
+# terms, including the whitespace and comments before it.
+fact = re.compile(r"""
+    (?P<skip>(?:\s+|%[^\n]*)*)
+    (?P<predicate>(?!-?\d){name}) \s*
+    (?:\( \s* (?P<terms>{term} (?:\s*,\s*{term})*) \s* \) \s*)?
+    \.
+""".format(name=name_pattern, term=r'(?:{}|{}|(?!-?\d){})'.format(number_pattern, string_pattern, name_pattern)), re.VERBOSE)
+
+# Pattern for a single term in the terms of a fact.
+fact_term = re.compile(r"""
+    \s* ({number}|{string}|{name}) \s* ,?
+""".format(number=number_pattern, string=string_pattern, name=name_pattern), re.VERBOSE)
+
+# Pattern for the spelling of a number.
+number_spelling = re.compile(number_pattern)
+
+
+def unescape(body):
+    """
+    Replaces the escape sequences in the body of a string literal.
+    """
+    if '\\' not in body:
+        return body
+
+    def replace(m):
+        if m.group(1):
+            return string_escapes[m.group(1)]
+        else:
+            return chr(int(m.group(2), base=8))
+
+    return string_escape.sub(replace, body)
+
+
+def tokenize_text(text, line=1):
+    """
+    Generator function to perform tokenization on a complete text. This
+    produces the same tokens as tokenize, but matches each token as a whole
+    instead of going through the text one character at a time.
+    """
+    pos = 0
+    end = len(text)
+    match = master.match
+    # contexts are never changed after construction, so the tokens on a line
+    # can share the same one
+    location = LocationContext(line)
+    while pos < end:
+        m = match(text, pos)
+        if m is None:
+            # Not a valid token, let the state machine take over to report the
+            # error in exactly the same way
+            yield from tokenize(io.StringIO(text[pos:]), line)
+            return
+
+        kind = m.lastgroup
+        spelling = m.group()
+        pos = m.end()
+        if kind == 'name':
+            yield (NAME, spelling, location)
+        elif kind == 'punct':
+            yield (punctuation[spelling], spelling, location)
+        elif kind == 'number':
+            yield (NUMBER, number(spelling), location)
+        elif kind == 'string':
+            yield (STRING, unescape(spelling[1:-1]), location)
+
+        if kind == 'space' or kind == 'string':
+            lines = spelling.count('\n')
+            if lines:
+                line += lines
+                location = LocationContext(line)
@@ -17,6 +17,13 @@ class Sentence:
     def create_bdd(self):
         raise NotImplementedError
 
+    def key(self):
+        """
+        Produces a hashable key for the sentence. Sentences with the same
+        structure have equal keys.
+        """
+        raise NotImplementedError
+
     def labels(self):
         return set()
 
@@ -42,6 +49,9 @@ class Nary(Sentence):
             terms.append(str(t))
         return '(' + (' ' + opstr + ' ').join(terms) + ')'
 
+    def key(self):
+        return (type(self), *(t.key() for t in self.terms))
+
     def labels(self):
         return {e for t in self.terms for e in t.labels()}
 
@@ -56,6 +66,9 @@ class Unary(Sentence):
     def __init__(self, sub):
         self.sub = sub
 
+    def key(self):
+        return (type(self), self.sub.key())
+
     def labels():
         return self.sub.labels()
 
@@ -67,6 +80,10 @@ class Unary(Sentence):
 
 
 class Atom(Sentence, metaclass=interned.InternalizeMeta):
+    def key(self):
+        # atoms are interned, so they are their own key
+        return self
+
     def subst(self, env):
         return self
 
@@ -237,27 +254,30 @@ def label_bdd_var(partition, part):
     return bdd.variable(partition.tag() + '_' + part.tag())
 
 
+def exclusion(partitioning, parts):
+    """
+    Generates the exclusion bdd for a single partitioning with the given
+    parts. So if x has parts 1 and 2, the exclusion holds if exactly one of
+    x=1 and x=2 holds. Returns None if there is nothing to exclude.
+    """
+    if len(parts) > 1:
+        return bdd.exactly_one([label_bdd_var(partitioning, part) for part in parts])
+    return None
+
+
 def exclusion_matrix(partitions, kb):
     """
     Generates exclusion bdd's. So if xN has domain var[1,2] the following
     exclusion is generated: (x1 and not x2) or (x2 and not x1)
+
+    The exclusions of the separate partitionings are obtained from the
+    knowledge base, which caches them.
     """
     excl = None
     for key in partitions:
-        group = kb.parts(key)
-        if len(group) > 1:
-            excl_sub = None
-            excl_subsub = None
-            for id in group:
-                excl_subsub = label_bdd_var(key, id)
-                for idnot in group:
-                    if id != idnot:
-                        excl_subsub = excl_subsub & ~label_bdd_var(key, idnot)
-                if excl_sub == None:
-                    excl_sub = excl_subsub
-                else:
-                    excl_sub = excl_sub | excl_subsub
-            if excl == None:
+        excl_sub = kb.exclusion(key)
+        if excl_sub is not None:
+            if excl is None:
                 excl = excl_sub
             else:
                 excl = excl & excl_sub
@@ -296,6 +316,47 @@ def falsehood(s, kb):
     return sbdd.is_zero()
 
 
+def probability(s, kb, prob):
+    """
+    Determines the exact probability of a descriptive sentence by weighted
+    model counting over its BDD. The probabilities are given as a mapping of
+    partitionings to a mapping of parts to probabilities. If a probability is
+    missing for any part involved in the sentence, None is returned.
+    """
+    labels = s.labels()
+
+    sbdd = s.create_bdd()
+    weights = {}
+    for partitioning in {t[0] for t in labels}:
+        used = kb.parts(partitioning)
+        group = used | {t[1] for t in labels if t[0] == partitioning}
+        try:
+            probs = prob[partitioning]
+        except KeyError:
+            return None
+        if not group <= probs.keys():
+            return None
+
+        # Parts that are not used by any clause can still be chosen, so the
+        # exclusion covers all parts with a probability. It forces exactly one
+        # part to be chosen, so every path to ONE decides all of its labels. A
+        # lone part is not constrained, and is simply chosen with its
+        # probability.
+        group = set(probs)
+        if len(group) > 1:
+            if group == used:
+                sbdd = sbdd & kb.exclusion(partitioning)
+            else:
+                sbdd = sbdd & exclusion(partitioning, group)
+            for part in group:
+                weights[label_bdd_var(partitioning, part).node.root] = (probs[part], 1.0)
+        else:
+            for part in group:
+                weights[label_bdd_var(partitioning, part).node.root] = (probs[part], 1.0 - probs[part])
+
+    return sbdd.weighted_count(weights)
+
+
 def labels(s):
     return s.labels()
 
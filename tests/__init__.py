@@ -6,3 +6,6 @@ from tests import test_cases
 
 from tests import test_worlds
 from tests import test_knowledge
+from tests import test_bdd
+from tests import test_context
+from tests import test_snapshot
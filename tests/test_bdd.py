@@ -0,0 +1,77 @@
+#!/usr/bin/env python3.4
+
+from tests.lawful import test
+
+from judged import bdd
+
+
+@test.bdd
+def operations():
+    x = bdd.variable('test_x')
+    y = bdd.variable('test_y')
+    z = bdd.variable('test_z')
+
+    assert (x & ~x).is_zero()
+    assert (x | ~x).is_one()
+    assert ~~x == x
+    assert (x & y) == (y & x)
+    assert ~(x & y) == (~x | ~y)
+    assert (x ^ y) == ((x & ~y) | (~x & y))
+    assert ((x | y) & z) == ((x & z) | (y & z))
+    assert (x & y).restrict({x.node.root: bdd.ONE}) == y
+
+
+@test.bdd
+def computed_table():
+    names = ['test_v{}'.format(i) for i in range(12)]
+    variables = [bdd.variable(n) for n in names]
+
+    def exactly_one():
+        result = bdd.constant(False)
+        for v in variables:
+            term = v
+            for w in variables:
+                if w is not v:
+                    term = term & ~w
+            result = result | term
+        return result
+
+    expected = exactly_one()
+
+    # results must not depend on the contents or size of the computed table
+    bdd.set_cache_size(4)
+    try:
+        assert exactly_one() == expected
+    finally:
+        bdd.set_cache_size(2**16)
+    bdd.clear_caches()
+    assert exactly_one() == expected
+    assert (expected & variables[0] & variables[1]).is_zero()
+
+
+@test.bdd
+def exactly_one():
+    variables = [bdd.variable('test_e{}'.format(i)) for i in range(5)]
+
+    expected = bdd.constant(False)
+    for v in variables:
+        term = v
+        for w in variables:
+            if w is not v:
+                term = term & ~w
+        expected = expected | term
+
+    assert bdd.exactly_one(variables) == expected
+    assert bdd.exactly_one(list(reversed(variables))) == expected
+    assert bdd.exactly_one(variables[:1]) == variables[0]
+
+
+@test.bdd
+def deep_count():
+    # the count must not be limited by the recursion depth
+    n = 3000
+    variables = [bdd.variable('test_d{}'.format(i)) for i in range(n)]
+    p = 1 / n
+    weights = {v.node.root: (p, 1 - p) for v in variables}
+    count = bdd.exactly_one(variables).weighted_count(weights)
+    assert abs(count - n * p * (1 - p)**(n - 1)) < 1e-9, str(count)
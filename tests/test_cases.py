@@ -9,6 +9,7 @@ from judged import context
 from judged import actions
 
 import io
+import functools
 from pathlib import Path
 import difflib
 
@@ -56,8 +57,8 @@ def make_suite(path, root, context_type):
                         action
                     ))
 
-        expected.sort(key=lambda c: c.id)
-        output.sort(key=lambda c: c.id)
+        expected.sort(key=str)
+        output.sort(key=str)
 
         if not compare_lists(output, expected):
             output_lines = ''.join("{}.\n".format(a) for a in output).splitlines(keepends=True)
@@ -73,6 +74,11 @@ def make_suite(path, root, context_type):
 for case in Path('tests/cases/deterministic').glob('*.dl'):
     make_suite(case, Path('tests/cases/deterministic'), context.DeterministicContext)
 
+# negloops1 is not stratified, and can not be evaluated bottom-up
+for case in Path('tests/cases/deterministic').glob('*.dl'):
+    if case.stem not in ('negloops1',):
+        make_suite(case, Path('tests/cases/deterministic'), functools.partial(context.DeterministicContext, prover='seminaive'))
+
 for case in Path('tests/cases/exact').glob('*.dl'):
     make_suite(case, Path('tests/cases/exact'), context.ExactContext)
 
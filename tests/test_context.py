@@ -0,0 +1,302 @@
+#!/usr/bin/env python3.4
+
+import io
+import collections
+import random
+
+from tests.lawful import test
+
+import judged
+from judged import parser
+from judged import context
+from judged import actions
+from judged import sampling
+
+
+program = """
+coin(c1) [x=heads].
+coin(c2) [x=tails].
+coin(c3) [y=heads].
+@P(x=heads) = 0.5.
+@P(x=tails) = 0.5.
+@P(y=heads) = 1.0.
+"""
+
+
+def setup(ctx):
+    for action in parser.parse(io.StringIO(program)):
+        action.perform(ctx)
+    return ctx
+
+
+def ask(ctx, query):
+    action = next(iter(parser.parse(io.StringIO(query))))
+    assert isinstance(action, actions.QueryAction)
+    result = ctx.ask(action.clause.head)
+    return result, {str(a.clause): a.probability for a in result.answers}
+
+
+@test.context
+def montecarlo_seed():
+    _, first = ask(setup(context.MontecarloContext(number=200, seed=42)), 'coin(X)?')
+    _, second = ask(setup(context.MontecarloContext(number=200, seed=42)), 'coin(X)?')
+    assert first == second
+    assert first['coin(c3)'] == 1.0
+
+
+@test.context
+def montecarlo_jobs():
+    ctx = setup(context.MontecarloContext(number=2500, seed=42, jobs=3))
+    result, first = ask(ctx, 'coin(X)?')
+    assert result.notes['iterations'] == 2500
+    assert first['coin(c3)'] == 1.0
+    assert abs(first['coin(c1)'] + first['coin(c2)'] - 1.0) < 1e-9
+
+    # workers are seeded from the context, which makes the run reproducible
+    _, second = ask(setup(context.MontecarloContext(number=2500, seed=42, jobs=3)), 'coin(X)?')
+    assert first == second
+
+    # queries that do not depend on any choices need only a single run
+    result, answers = ask(ctx, 'coin(c3)?')
+    assert result.notes['iterations'] == 1
+
+
+@test.context
+def montecarlo_lineage():
+    ctx = setup(context.MontecarloContext(number=4000, seed=42, lineage=True))
+    _, answers = ask(ctx, 'coin(X)?')
+    assert set(answers) == {'coin(c1)', 'coin(c2)', 'coin(c3)'}
+    assert answers['coin(c3)'] == 1.0
+    assert abs(answers['coin(c1)'] - 0.5) < 0.05
+    assert abs(answers['coin(c1)'] + answers['coin(c2)'] - 1.0) < 1e-9
+
+    # the lineage is derived again for each query
+    result, answers = ask(ctx, 'coin(c3)?')
+    assert answers == {'coin(c3)': 1.0}
+    assert result.notes['iterations'] == 1
+
+
+if sampling.available:
+    @test.context
+    def montecarlo_batch():
+        ctx = setup(context.MontecarloContext(number=20000, seed=42, batch=3000))
+        result, answers = ask(ctx, 'coin(X)?')
+        assert result.notes['iterations'] == 20000
+        assert set(answers) == {'coin(c1)', 'coin(c2)', 'coin(c3)'}
+        assert answers['coin(c3)'] == 1.0
+        assert abs(answers['coin(c1)'] - 0.5) < 0.02
+        assert abs(answers['coin(c1)'] + answers['coin(c2)'] - 1.0) < 1e-9
+
+        _, again = ask(setup(context.MontecarloContext(number=20000, seed=42, batch=3000)), 'coin(X)?')
+        assert answers == again
+
+        result, answers = ask(ctx, 'coin(c3)?')
+        assert answers == {'coin(c3)': 1.0}
+        assert result.notes['iterations'] == 1
+
+    @test.context
+    def montecarlo_batch_rounding():
+        # seven probabilities of 1/7 sum to just below 1.0 with floating
+        # point numbers, which must still cover every drawn number
+        z = judged.worlds.LabelConstant('z')
+        parts = [judged.worlds.LabelConstant(str(i)) for i in range(7)]
+        lineage = [(None, judged.worlds.Label(z, parts[6]))]
+        sampler = sampling.BatchSampler(lineage, {z: {p: 1 / 7 for p in parts}})
+        assert sampler.cumulative[0][-1] == 1.0
+
+        class Upper:
+            def random(self, shape):
+                return sampling.numpy.full(shape, 1.0 - 1e-16)
+        samples = sampler.draw(Upper(), 4)
+        assert (samples == 6).all(), str(samples)
+
+        # a part without probability is not chosen on a boundary either
+        probs = {parts[0]: 0.0, parts[1]: 0.5, parts[2]: 0.0, parts[3]: 0.5}
+        lineage = [(None, judged.worlds.Label(z, parts[0]))]
+        sampler = sampling.BatchSampler(lineage, {z: probs})
+
+        class Boundaries:
+            def random(self, shape):
+                return sampling.numpy.array([[0.0], [0.5]])
+        samples = sampler.draw(Boundaries(), 2)
+        assert samples[:, 0].tolist() == [1, 3], str(samples)
+
+
+@test.context
+def montecarlo_estimate():
+    x = judged.worlds.LabelConstant('x')
+    heads = judged.worlds.LabelConstant('heads')
+    tails = judged.worlds.LabelConstant('tails')
+    prob = {x: {heads: 0.3, tails: 0.7}}
+    wh = frozenset([(x, heads)])
+    wt = frozenset([(x, tails)])
+
+    def tally(*runs):
+        result = sampling.Tally()
+        for answers, world in runs:
+            result.add((), 1, answers, world)
+        return result
+
+    estimate = context.Estimate(prob, 0.95)
+    estimate.update(tally((['a'], wh), (['a'], wh), ([], wt)))
+    estimate.update(tally((['a', 'b'], wh), (['b'], wt), (['b'], wt), ([], wt), ([], wt)))
+
+    naive = (((0.3 - 3/8)**2 + (0.7 - 5/8)**2) / 2)**0.5
+    assert abs(estimate.error() - naive) < 1e-9
+    assert estimate.probability('a') == 3/8
+    assert estimate.probability('b') == 3/8
+    assert estimate.precision() == estimate.interval(3/8)
+    assert abs(estimate.variance('a') - (3/8) * (5/8) / 8) < 1e-12
+
+
+@test.context
+def montecarlo_precision():
+    ctx = setup(context.MontecarloContext(number=0, seed=42, precision=0.05, check_every=10))
+    result, answers = ask(ctx, 'coin(X)?')
+    assert result.notes['precision'] <= 0.05
+    assert result.notes['iterations'] < 1000
+    assert result.notes['iterations'] % 10 == 1
+
+    # each answer reports the width of its own interval
+    widths = result.notes['widths']
+    assert set(widths) == set(answers), str(widths)
+    assert widths['coin(c3)'] < widths['coin(c1)'] <= result.notes['precision']
+
+    # the intervals end a bounded run as soon as they are narrow enough
+    ctx = setup(context.MontecarloContext(number=100000, seed=42, precision=0.05, check_every=10))
+    result, answers = ask(ctx, 'coin(X)?')
+    assert result.notes['iterations'] < 1000
+    assert max(result.notes['widths'].values()) <= 0.05
+
+
+@test.context
+def alias_table():
+    probabilities = {'a': 0.5, 'b': 0.25, 'c': 0.125, 'd': 0.125, 'e': 0.0}
+    table = sampling.AliasTable(probabilities)
+
+    # the columns and aliases together hold exactly the given probabilities
+    n = len(table.outcomes)
+    mass = collections.Counter()
+    for i, outcome in enumerate(table.outcomes):
+        mass[outcome] += table.accept[i] / n
+        mass[table.outcomes[table.alias[i]]] += (1 - table.accept[i]) / n
+    for outcome, p in probabilities.items():
+        assert abs(mass[outcome] - p) < 1e-9, outcome
+
+    source = random.Random(42)
+    draws = collections.Counter(table.draw(source) for i in range(10000))
+    assert draws['e'] == 0
+    assert abs(draws['a'] / 10000 - 0.5) < 0.03
+
+
+@test.context
+def montecarlo_distributions():
+    ctx = setup(context.MontecarloContext(number=10))
+    x = judged.worlds.LabelConstant('x')
+    heads = judged.worlds.LabelConstant('heads')
+
+    assert ctx.pick(x) in ctx.prob[x]
+    table = ctx.table(x)
+    assert ctx.table(x) is table
+
+    # changing the probabilities replaces the table, and invalid
+    # distributions are reported
+    ctx.add_probability(x, heads, 0.9)
+    try:
+        ctx.pick(x)
+    except judged.JudgedError as e:
+        assert 'sum to 1.0' in e.message
+    else:
+        assert False, "Invalid distribution not reported"
+
+    try:
+        ctx.pick(judged.worlds.LabelConstant('w'))
+    except judged.JudgedError as e:
+        assert 'not set' in e.message
+    else:
+        assert False, "Missing distribution not reported"
+
+
+@test.context
+def montecarlo_strategies():
+    for strategy in ('stratified', 'importance'):
+        ctx = setup(context.MontecarloContext(number=2000, seed=42, strategy=strategy))
+        result, _ = ask(ctx, 'coin(X)?')
+        answers = {str(a.clause): a for a in result.answers}
+        assert abs(answers['coin(c1)'].probability - 0.5) < 0.05, strategy
+        assert abs(answers['coin(c3)'].probability - 1.0) < 1e-9, strategy
+        assert answers['coin(c1)'].variance is not None
+
+    # with few partitionings, each stratum decides all labels
+    ctx = setup(context.MontecarloContext(number=100, seed=42, strategy='stratified'))
+    result, answers = ask(ctx, 'coin(X)?')
+    assert abs(answers['coin(c1)'] - 0.5) < 1e-9
+    assert all(a.variance == 0.0 for a in result.answers)
+
+    try:
+        context.MontecarloContext(strategy='unknown')
+    except judged.JudgedError as e:
+        assert 'unknown' in e.message
+    else:
+        assert False, "Unknown strategy not reported"
+
+
+@test.context
+def ask_many():
+    import threading
+    import time
+
+    ctx = setup(context.ExactContext())
+    queries = [next(iter(parser.parse(q))).clause.head for q in ['coin(X)?', 'coin(c1)?', 'coin(c3)?', 'coin(c4)?'] * 5]
+    results = ctx.ask_many(queries, workers=4)
+    expected = [ctx.ask(q) for q in queries]
+    for result, single in zip(results, expected):
+        answers = {str(a.clause): a.probability for a in result.answers}
+        assert answers == {str(a.clause): a.probability for a in single.answers}, str(answers)
+    assert len(ctx.prover_pool) == 4
+
+    # the montecarlo context answers one query at a time
+    mc = setup(context.MontecarloContext(number=50, seed=1))
+    assert len(mc.ask_many(queries[:2], workers=2)) == 2
+    assert mc.prover_pool == []
+
+    # a change waits until the readers are done, while a reader can still
+    # read again
+    lock = ctx.knowledge.lock
+    lock.acquire_read()
+    writer = threading.Thread(target=lambda: ctx.knowledge.assert_clause(next(iter(parser.parse('coin(c4).'))).clause))
+    writer.start()
+    time.sleep(0.05)
+    assert writer.is_alive()
+    _, answers = ask(ctx, 'coin(c4)?')
+    assert answers == {}, str(answers)
+    lock.release_read()
+    writer.join()
+    _, answers = ask(ctx, 'coin(c4)?')
+    assert answers == {'coin(c4)': 1.0}, str(answers)
+
+
+@test.context
+def ask_many_renaming():
+    import sys
+
+    rules = """
+    edge(a, b). edge(b, c). edge(c, d). edge(d, e). edge(e, a).
+    path(X, Y) :- edge(X, Y).
+    path(X, Y) :- edge(X, Z), path(Z, Y).
+    """
+    ctx = context.DeterministicContext()
+    for action in parser.parse(io.StringIO(rules)):
+        action.perform(ctx)
+    queries = [next(iter(parser.parse(q))).clause.head for q in ['path(a, X)?', 'path(X, c)?', 'path(X, Y)?', 'path(d, e)?'] * 25]
+    expected = [{str(a.clause) for a in ctx.ask(q).answers} for q in queries]
+
+    # switch threads often, so that renaming apart interleaves between provers
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        results = ctx.ask_many(queries, workers=8)
+    finally:
+        sys.setswitchinterval(interval)
+    for result, single in zip(results, expected):
+        assert {str(a.clause) for a in result.answers} == single
@@ -47,6 +47,218 @@ def primitives():
     assert answer == set(), str(answer)
 
 
+@test.knowledge
+def binding_modes():
+    from judged import extensions
+    from judged import context
+
+    ext = extensions.Extension('tests.test_knowledge')
+    calls = []
+
+    @ext.predicate('edge', 2, modes=['bf', 'bb'])
+    def edge(a, b):
+        calls.append((a, b))
+        for row in [(1, 'x'), (1, 'y'), (2, 'x')]:
+            if row[0] == a and b in (None, row[1]):
+                yield row
+
+    ctx = context.DeterministicContext()
+    ext.register_predicate(ctx, 'edge')
+    kb = ctx.knowledge
+    p = pred('edge', 2)
+
+    answer = [c.head for c in kb.clauses(lit(p, [const.number(1), var('X')]))]
+    assert answer == [lit(p, [const.number(1), const.string('x')]), lit(p, [const.number(1), const.string('y')])], str(answer)
+    answer = [c.head for c in kb.clauses(lit(p, [const.number(2), const.string('x')]))]
+    assert answer == [lit(p, [const.number(2), const.string('x')])], str(answer)
+    assert calls == [(1, None), (2, 'x')], str(calls)
+
+    # the first argument must be bound
+    try:
+        list(kb.clauses(lit(p, [var('X'), const.string('x')])))
+        assert False, "Predicate was called without a binding mode"
+    except extensions.ExtensionError:
+        pass
+
+
+@test.knowledge
+def batched_calls():
+    from judged import extensions
+    from judged import context
+    from judged import parser
+
+    ext = extensions.Extension('tests.test_knowledge.batched')
+    calls = []
+
+    @ext.predicate('double', 2, modes=['bf'], batch=True)
+    def double(bindings):
+        calls.append(bindings)
+        return [[(a, 2 * a)] for a, b in bindings]
+
+    for prover in ('slg', 'seminaive'):
+        calls.clear()
+        ctx = context.DeterministicContext(prover=prover)
+        ext.register_predicate(ctx, 'double')
+        for action in parser.parse("n(1). n(2). n(3). n(2). d(X, Y) :- n(X), double(X, Y)."):
+            action.perform(ctx)
+        query = lit(pred('d', 2), [var('X'), var('Y')])
+        answer = sorted(str(a.clause.head) for a in ctx.ask(query).answers)
+        assert answer == ['d(1, 2)', 'd(2, 4)', 'd(3, 6)'], str(answer)
+        # all bindings of the join are passed in a single call
+        assert len(calls) == 1 and sorted(calls[0]) == [(1, None), (2, None), (3, None)], (prover, calls)
+
+    # batches only work with binding modes
+    try:
+        ext.predicate('plain', 1, batch=True)
+        assert False, "Batch predicate without binding modes was accepted"
+    except extensions.ExtensionError:
+        pass
+
+
+@test.knowledge
+def cached_calls():
+    from judged import extensions
+    from judged import context
+
+    ext = extensions.Extension('tests.test_knowledge.cached')
+    calls = []
+
+    @ext.predicate('square', 2, modes=['bf'], cache='query')
+    def square(a, b):
+        calls.append(a)
+        yield (a, a * a)
+
+    @ext.predicate('cube', 2, modes=['bf'], cache='session', cache_size=2)
+    def cube(a, b):
+        calls.append(a)
+        yield (a, a * a * a)
+
+    ctx = context.DeterministicContext()
+    ctx.use_extension(ext, {})
+    ctx.use_predicate(ext, None)
+
+    def ask(name, n):
+        query = lit(pred(name, 2), [const.number(n), var('Y')])
+        return [str(a.clause.head) for a in ctx.ask(query).answers]
+
+    # query caches are dropped after each ask
+    assert ask('square', 3) == ['square(3, 9)']
+    assert ask('square', 3) == ['square(3, 9)']
+    assert calls == [3, 3], str(calls)
+
+    # session caches are kept, but only for the most recent calls
+    calls.clear()
+    assert ask('cube', 2) == ['cube(2, 8)']
+    assert ask('cube', 2) == ['cube(2, 8)']
+    ask('cube', 3)
+    ask('cube', 4)
+    ask('cube', 2)
+    assert calls == [2, 3, 4, 2], str(calls)
+
+    # and can be invalidated explicitly
+    ext.invalidate(ctx, 'cube')
+    ask('cube', 2)
+    assert calls == [2, 3, 4, 2, 2], str(calls)
+
+    # the runs of a Monte Carlo query share the query cache, which is dropped
+    # after the query
+    mc = context.MontecarloContext(number=20, seed=1)
+    mc.use_extension(ext, {})
+    mc.use_predicate(ext, None)
+    calls.clear()
+    for i in range(2):
+        query = lit(pred('square', 2), [const.number(5), var('Y')])
+        answer = [str(a.clause.head) for a in mc.ask(query).answers]
+        assert answer == ['square(5, 25)'], str(answer)
+    assert calls == [5, 5], str(calls)
+
+    @ext.predicate('pair', 2, cache='session')
+    def pair(pred, a, b):
+        calls.append((a, b))
+        yield judged.Clause(judged.Literal(pred, [const.number(1), b]))
+
+    ctx.use_predicate(ext, None)
+
+    # calls without binding modes are cached by their variant form, so that
+    # renamed variables hit the same entry
+    calls.clear()
+    for name in ('Y', 'Z'):
+        query = lit(pred('pair', 2), [var('X'), var(name)])
+        answer = [str(a.clause.head) for a in ctx.ask(query).answers]
+        assert answer == ['pair(1, {})'.format(name)], str(answer)
+    assert len(calls) == 1, str(calls)
+
+    for spec in ('forever', 'ttl:', 'ttl:-1'):
+        try:
+            ext.predicate('bad', 1, cache=spec)
+            assert False, "Invalid cache '{}' was accepted".format(spec)
+        except extensions.ExtensionError:
+            pass
+
+
+@test.knowledge
+def async_calls():
+    import asyncio
+    from judged import extensions
+    from judged import context
+    from judged import parser
+
+    ext = extensions.Extension('tests.test_knowledge.async')
+    running = [0, 0]
+
+    @ext.predicate('fetch', 2, modes=['bf'])
+    async def fetch(a, b):
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return [(a, a + 10)]
+
+    @ext.predicate('stream', 1)
+    async def stream(pred, a):
+        for i in range(2):
+            await asyncio.sleep(0)
+            yield judged.Clause(judged.Literal(pred, [const.number(i)]))
+
+    for prover in ('slg', 'seminaive'):
+        running[:] = [0, 0]
+        ctx = context.DeterministicContext(prover=prover)
+        ctx.use_extension(ext, {})
+        ctx.use_predicate(ext, None)
+        for action in parser.parse("n(1). n(2). n(3). d(X, Y) :- n(X), fetch(X, Y). s(X) :- stream(X)."):
+            action.perform(ctx)
+        answer = sorted(str(a.clause.head) for a in ctx.ask(lit(pred('d', 2), [var('X'), var('Y')])).answers)
+        assert answer == ['d(1, 11)', 'd(2, 12)', 'd(3, 13)'], str(answer)
+        answer = sorted(str(a.clause.head) for a in ctx.ask(lit(pred('s', 1), [var('X')])).answers)
+        assert answer == ['s(0)', 's(1)'], str(answer)
+        # the calls of the join are in flight at the same time
+        assert running[1] == 3, (prover, running)
+
+    # a batch is answered with a single list, not an async generator
+    try:
+        @ext.predicate('lines', 2, modes=['bf'], batch=True)
+        async def lines(bindings):
+            yield []
+        assert False, "Async generator was accepted for a batch predicate"
+    except extensions.ExtensionError:
+        pass
+
+    # judged can be used from async code, whose loop is already running
+    async def serve():
+        return ctx.ask(lit(pred('d', 2), [var('X'), var('Y')]))
+    answer = sorted(str(a.clause.head) for a in asyncio.run(serve()).answers)
+    assert answer == ['d(1, 11)', 'd(2, 12)', 'd(3, 13)'], str(answer)
+
+    # the loop of a thread is closed when the thread exits
+    import threading
+    loops = []
+    thread = threading.Thread(target=lambda: loops.append(extensions.thread_loop()))
+    thread.start()
+    thread.join()
+    del thread
+    assert loops[0].is_closed()
+
+
 @test.knowledge
 def safety():
     kb = judged.logic.Knowledge(None)
@@ -71,3 +283,97 @@ def safety():
 
     c2 = clause(l3, [l4], [], wand(wl('x','1'), wlabel(wlf('p', (const.symbol('y'),)),wlc('2'))))
     assert assert_clause(c2), "Safe clause {} was rejected".format(c2)
+
+
+@test.knowledge
+def indexing():
+    kb = judged.logic.Knowledge(None)
+
+    p = pred('p', 2)
+    facts = [clause(lit(p, [const(a), const(b)])) for a in ('a', 'b', 'c') for b in ('x', 'y')]
+    for c in facts:
+        kb.assert_clause(c)
+    r1 = clause(lit(p, [var('X'), const('x')]), [lit(pred('q', 1), [var('X')])])
+    kb.assert_clause(r1)
+
+    answer = set(kb.clauses(lit(p, [const('a'), var('Y')])))
+    assert answer == {facts[0], facts[1], r1}, str(answer)
+
+    answer = set(kb.clauses(lit(p, [const('b'), const('y')])))
+    assert answer == {facts[3]}, str(answer)
+
+    answer = set(kb.clauses(lit(p, [const('b'), const('x')])))
+    assert answer == {facts[2], r1}, str(answer)
+
+    answer = set(kb.clauses(lit(p, [var('X'), var('Y')])))
+    assert answer == set(facts) | {r1}, str(answer)
+
+    kb.retract_clause(facts[2])
+    kb.retract_clause(r1)
+    answer = set(kb.clauses(lit(p, [const('b'), const('x')])))
+    assert answer == set(), str(answer)
+
+    kb.assert_clause(facts[2])
+    answer = set(kb.clauses(lit(p, [const('b'), const('x')])))
+    assert answer == {facts[2]}, str(answer)
+
+
+@test.knowledge
+def bulk():
+    kb = judged.logic.Knowledge(None)
+    changes = []
+    kb.listeners.append(lambda predicate, clause, added: changes.append(predicate))
+
+    p = pred('p', 2)
+    facts = [clause(lit(p, [const(a), const(b)])) for a in 'abc' for b in 'xy']
+    rule = clause(lit(pred('q', 1), [var('X')]), [lit(p, [var('X'), const('x')])])
+    labelled = clause(lit(p, [const('d'), const('x')]), [], [], wl('x', '1'))
+    kb.assert_facts(facts + [rule, labelled] + facts[:2])
+
+    # the facts are added at once, the other clauses separately
+    assert changes == [pred('q', 1), p, p], str(changes)
+    assert set(kb.clauses(lit(p, [var('X'), const('x')]))) == set(facts[::2]) | {labelled}
+    assert set(kb.clauses(lit(pred('q', 1), [var('X')]))) == {rule}
+    assert kb.parts(wlc('x')) == {wlc('1')}
+
+    # ground facts are not checked for safety, but others still are
+    try:
+        kb.assert_facts([clause(lit(p, [var('X'), const('x')]))])
+        assert False, "Unsafe clause was asserted"
+    except judged.SafetyError:
+        pass
+
+
+@test.knowledge
+def partitions():
+    kb = judged.logic.Knowledge(None)
+
+    l1 = lit(pred('f', 1), [const.symbol('a')])
+    l2 = lit(pred('f', 1), [const.symbol('b')])
+    l3 = lit(pred('f', 1), [const.symbol('c')])
+
+    c1 = kb.assert_clause(clause(l1, [], [], wl('x', '1')))
+    c2 = kb.assert_clause(clause(l2, [], [], wl('x', '2')))
+    c3 = kb.assert_clause(clause(l3, [], [], wor(wl('x', '1'), wl('y', '1'))))
+
+    assert kb.parts(wlc('x')) == {wlc('1'), wlc('2')}
+    assert kb.parts(wlc('y')) == {wlc('1')}
+
+    # a single part has nothing to exclude
+    assert kb.exclusion(wlc('y')) is None
+    excl = kb.exclusion(wlc('x'))
+    assert excl == wor(wand(wl('x', '1'), wnot(wl('x', '2'))), wand(wl('x', '2'), wnot(wl('x', '1')))).create_bdd()
+    assert kb.exclusion(wlc('x')) is excl
+
+    # the part remains in use as long as any clause mentions it
+    kb.retract_clause(c1)
+    assert kb.parts(wlc('x')) == {wlc('1'), wlc('2')}
+    assert kb.exclusion(wlc('x')) is excl
+
+    kb.retract_clause(c3)
+    assert kb.parts(wlc('x')) == {wlc('2')}
+    assert kb.parts(wlc('y')) == set()
+    assert kb.exclusion(wlc('x')) is None
+
+    kb.assert_clause(c1)
+    assert kb.exclusion(wlc('x')) == excl
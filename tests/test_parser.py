@@ -59,3 +59,22 @@ def from_annotation():
     assert c.module == 'fooext'
     assert c.predicate == None
     assert c.alias == None
+
+
+@test.parser
+def bulk():
+    from judged import Clause, Literal, Constant, Predicate
+
+    source = '% facts\nfoo(x, "y", -1).\nfoo(a-b, "\\101", 2.5). bar.\nbaz(X) :- foo(X, _, _).\nbaz(x)?\nfoo(z, "", 0).'
+    a = parser.parse_bulk(source)
+    assert [type(c) for c in a] == [actions.AssertFactsAction, actions.AssertAction, actions.QueryAction, actions.AssertFactsAction]
+    assert [str(c.source) for c in a] == [':2-3', ':4', ':5', ':6']
+
+    # the facts are the same as when parsed one by one
+    expected = [c.clause for c in parser.parse(source) if type(c) == actions.AssertAction and not c.clause.body]
+    assert a[0].clauses + a[3].clauses == expected
+    assert a[0].clauses[0] == Clause(Literal(Predicate('foo', 3), [Constant.symbol('x'), Constant.string('y'), Constant.number(-1)]))
+
+    # facts with variables are left to the normal parse
+    b = parser.parse_bulk('foo(X).')
+    assert [type(c) for c in b] == [actions.AssertAction]
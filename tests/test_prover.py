@@ -68,3 +68,80 @@ def equals():
     query = lit(pred('y',1),[var('X')])
     answer = prover.ask(query, lambda s: True)
     assert set(answer) == set([clause(lit(pred('y',1), [const('foo')]),[],[]), clause(lit(pred('y',1), [const('bar')]),[],[])])
+
+@test.prover
+def table_reuse():
+    kb = Knowledge(None)
+    prover = Prover(kb, reuse_tables=True)
+    checker = lambda k, p: True
+
+    edge = pred('edge', 2)
+    path = pred('path', 2)
+    kb.assert_clause(clause(lit(path, [var('X'), var('Y')]), [lit(edge, [var('X'), var('Y')])]))
+    kb.assert_clause(clause(lit(path, [var('X'), var('Y')]), [lit(edge, [var('X'), var('Z')]), lit(path, [var('Z'), var('Y')])]))
+    kb.assert_clause(clause(lit(edge, [const('a'), const('b')])))
+    kb.assert_clause(clause(lit(edge, [const('b'), const('c')])))
+
+    query = lit(path, [const('a'), var('Y')])
+    answer = set(prover.ask(query, checker))
+    assert answer == {clause(lit(path, [const('a'), const(n)])) for n in 'bc'}
+    assert query.tag() in prover.subgoals
+
+    # unrelated changes keep the table
+    kb.assert_clause(clause(lit(pred('other', 1), [const('a')])))
+    answer = set(prover.ask(query, checker))
+    assert query.tag() in prover.subgoals
+    table = prover.subgoals[query.tag()]
+    set(prover.ask(lit(path, [const('a'), var('Z')]), checker))
+    assert prover.subgoals[query.tag()] is table
+
+    # changes to dependencies discard the table
+    kb.assert_clause(clause(lit(edge, [const('c'), const('d')])))
+    answer = set(prover.ask(query, checker))
+    assert prover.subgoals[query.tag()] is not table
+    assert answer == {clause(lit(path, [const('a'), const(n)])) for n in 'bcd'}
+
+@test.prover
+def incremental_maintenance():
+    from judged.seminaive import SeminaiveProver
+
+    kb = Knowledge(None)
+    prover = SeminaiveProver(kb)
+    checker = lambda k, p: True
+
+    edge = pred('edge', 2)
+    path = pred('path', 2)
+    node = pred('node', 1)
+    unreach = pred('unreach', 2)
+    kb.assert_clause(clause(lit(path, [var('X'), var('Y')]), [lit(edge, [var('X'), var('Y')])]))
+    kb.assert_clause(clause(lit(path, [var('X'), var('Y')]), [lit(path, [var('X'), var('Z')]), lit(edge, [var('Z'), var('Y')])]))
+    kb.assert_clause(clause(lit(node, [var('X')]), [lit(edge, [var('X'), var('Y')])]))
+    kb.assert_clause(clause(lit(node, [var('Y')]), [lit(edge, [var('X'), var('Y')])]))
+    kb.assert_clause(clause(lit(unreach, [var('X'), var('Y')]), [lit(node, [var('X')]), lit(node, [var('Y')]), lit(path, [var('X'), var('Y')], False)]))
+    prover.maintain(unreach)
+
+    def edges(*pairs):
+        return [clause(lit(edge, [const(a), const(b)])) for a, b in pairs]
+
+    def unreachable():
+        query = lit(unreach, [var('A'), var('B')])
+        return {(a.head[0].name, a.head[1].name) for a in prover.ask(query, checker)}
+
+    for c in edges('ab', 'bc'):
+        kb.assert_clause(c)
+    assert unreachable() == {('a', 'a'), ('b', 'a'), ('b', 'b'), ('c', 'a'), ('c', 'b'), ('c', 'c')}
+    relation = prover.relations[path]
+
+    for c in edges('ca'):
+        kb.assert_clause(c)
+    assert unreachable() == set()
+
+    for c in edges('bc'):
+        kb.retract_clause(c)
+    assert unreachable() == {('a', 'a'), ('a', 'c'), ('b', 'a'), ('b', 'b'), ('b', 'c'), ('c', 'c')}
+    assert prover.relations[path] is relation
+
+    # facts loaded in bulk are maintained the same way
+    kb.assert_facts(edges('bc', 'cd'))
+    assert unreachable() == {('d', 'a'), ('d', 'b'), ('d', 'c'), ('d', 'd')}
+    assert prover.relations[path] is relation
@@ -0,0 +1,128 @@
+import io
+
+from tests.lawful import test
+
+import judged
+from judged import parser
+from judged import context
+from judged import extensions
+from judged import snapshot
+
+
+ext = extensions.Extension('tests.test_snapshot')
+
+
+@ext.predicate('double', 2)
+def double(pred, a, b):
+    yield judged.Clause(judged.Literal(pred, [a, judged.Constant.number(a.data * 2)]))
+
+
+program = """
+@from "tests.test_snapshot" use double as twice.
+coin(c1) [x=heads].
+coin(c2) [x=tails or f(1, "q")=2].
+coin(c3) [not y=heads and y=1].
+count(c1, -1). count(c2, 2.5). count("c3", "a\\nb").
+heads(C) :- coin(C), ~tails(C), C != c2.
+@P(x=heads) = 0.5.
+@P(x=tails) = 0.5.
+@P(y=heads) = 1.0.
+"""
+
+
+def clauses(ctx):
+    kb = ctx.knowledge
+    return {clause for db in (kb.facts, kb.rules) for bucket in db.values() for clause in bucket.values()}
+
+
+@test.snapshot
+def roundtrip():
+    original = context.ExactContext()
+    parser.parse(program).perform(original)
+
+    data = io.BytesIO()
+    snapshot.save(original, data)
+    data.seek(0)
+    loaded = context.ExactContext()
+    snapshot.load(loaded, data)
+
+    assert clauses(loaded) == clauses(original)
+    assert loaded.prob == original.prob
+    assert loaded.uses == original.uses
+
+    query = parser.parse_literal('twice(3, X)')
+    answers = [a.clause for a in loaded.ask(query).answers]
+    assert answers == [a.clause for a in original.ask(query).answers]
+    assert len(answers) == 1
+
+
+@test.snapshot
+def invalid():
+    for data in (b'', b'JUDGEDKB', b'NOTASNAPSHOT' * 4):
+        try:
+            snapshot.load(context.DeterministicContext(), io.BytesIO(data))
+            assert False, "Loaded an invalid snapshot"
+        except snapshot.SnapshotError:
+            pass
+
+
+@test.snapshot
+def corrupt():
+    import struct
+
+    original = context.ExactContext()
+    parser.parse(program).perform(original)
+    data = io.BytesIO()
+    snapshot.save(original, data)
+    valid = data.getvalue()
+
+    # overwriting any word of the code with an out of range number is either
+    # harmless or reported, but never fails otherwise
+    magic, version, count, length, size = snapshot.HEADER.unpack_from(valid)
+    start = len(valid) - 4 * size
+    reported = 0
+    for pos in range(start, len(valid), 4):
+        for word in (0xFFFFFFFF, 7):
+            data = bytearray(valid)
+            data[pos:pos + 4] = struct.pack('<I', word)
+            try:
+                snapshot.load(context.ExactContext(), io.BytesIO(bytes(data)))
+            except snapshot.SnapshotError:
+                reported += 1
+            except judged.JudgedError:
+                # such as a module name that changed
+                pass
+    assert reported > size, str(reported)
+
+
+@test.snapshot
+def mapped_file():
+    import mmap
+    import os
+    import tempfile
+    import types
+
+    original = context.ExactContext()
+    parser.parse(program).perform(original)
+
+    # record the maps that are made, to see that they are closed again
+    maps = []
+    class Recording(mmap.mmap):
+        def __init__(self, *args, **kwargs):
+            maps.append(self)
+
+    fd, name = tempfile.mkstemp()
+    os.close(fd)
+    snapshot.mmap = types.SimpleNamespace(mmap=Recording, ACCESS_READ=mmap.ACCESS_READ)
+    try:
+        snapshot.save(original, name)
+        for source in (name, open(name, 'rb')):
+            loaded = context.ExactContext()
+            snapshot.load(loaded, source)
+            assert clauses(loaded) == clauses(original)
+            if not isinstance(source, str):
+                source.close()
+    finally:
+        snapshot.mmap = mmap
+        os.remove(name)
+    assert len(maps) == 2 and all(m.closed for m in maps), str(maps)
@@ -94,3 +94,32 @@ ancestor(A, B)?
 
     tokens = list(tokenize(io.StringIO(source)))
     assert tokens == result
+
+    tokens = list(tokenize_text(source))
+    assert tokens == result
+
+
+@test.parser
+def tokenizer_text():
+    import io
+    from judged import TokenizeError
+
+    def tokens(tokenizer, source):
+        try:
+            return list(tokenizer(source))
+        except TokenizeError as e:
+            return (e.message, str(e.context))
+
+    sources = [
+        'a-b(-x, -1, - 1, 1.5, 1., 12abc).',
+        'p(X) :- q(X, Y), X != Y, Y=1.',
+        'x:-1. @a{b|c} ~[x=1]?',
+        '"a\\nb" "a\\qb" "a\\101b" "a\\\\" "tab\there"',
+        '% comment\na %c\n\n  b',
+        'a(b).\n"unterminated',
+        'a(b).\n\n"x\ny"',
+        'a :\n b',
+        'a(b) !',
+    ]
+    for source in sources:
+        assert tokens(tokenize_text, source) == tokens(lambda s: tokenize(io.StringIO(s)), source)
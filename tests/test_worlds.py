@@ -18,6 +18,9 @@ class TestKB():
     def parts(self, p):
         return {t[1] for t in self.labels if t[0]==p}
 
+    def exclusion(self, p):
+        return worlds.exclusion(p, self.parts(p))
+
 def test_equivalent_fun(l, r, extra_labels=set()):
     """ function used for testing Sentence equivalence function """
     return worlds.equivalent(l, r, TestKB(l.labels() | r.labels() | extra_labels) )
@@ -151,3 +154,35 @@ def substitution():
     assert s3.is_grounded()
     assert s4.is_grounded()
     assert test_equivalent_fun(s3, s4)
+
+@test.worlds
+def probability():
+    def prob(*assignments):
+        result = {}
+        for lbl, p in assignments:
+            l = label(lbl)
+            result.setdefault(l[0], {})[l[1]] = p
+        return result
+
+    def close(a, b):
+        return abs(a - b) < 1e-9
+
+    probs = prob(('x=1', 0.2), ('x=2', 0.3), ('x=3', 0.5), ('y=1', 0.6), ('y=2', 0.4), ('z=1', 0.7))
+    kb = TestKB({label(l) for l in ('x=1', 'x=2', 'x=3', 'y=1', 'y=2', 'z=1')})
+
+    assert close(worlds.probability(sentence('x=1'), kb, probs), 0.2)
+    assert close(worlds.probability(sentence('not x=1'), kb, probs), 0.8)
+    assert close(worlds.probability(sentence('x=1 or x=3'), kb, probs), 0.7)
+    assert close(worlds.probability(sentence('x=1 and x=2'), kb, probs), 0.0)
+    assert close(worlds.probability(sentence('x=1 and y=2'), kb, probs), 0.08)
+    assert close(worlds.probability(sentence('x=1 or y=2'), kb, probs), 0.2 + 0.4 - 0.08)
+    assert close(worlds.probability(sentence('(x=1 and y=1) or (x=2 and y=2)'), kb, probs), 0.12 + 0.12)
+    assert close(worlds.probability(sentence('z=1 and not y=1'), kb, probs), 0.28)
+    assert close(worlds.probability(sentence('true'), kb, probs), 1.0)
+
+    assert worlds.probability(sentence('w=1'), TestKB({label('w=1')}), probs) is None
+
+    # parts that are not used in the knowledge base can still be chosen
+    kb = TestKB({label('x=1'), label('y=1')})
+    assert close(worlds.probability(sentence('x=1 or y=1'), kb, probs), 0.2 + 0.6 - 0.12)
+    assert close(worlds.probability(sentence('not x=1'), kb, probs), 0.8)